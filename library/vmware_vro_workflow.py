@@ -38,6 +38,7 @@ short_description: Executes workflows on vRealize Orchestrator
 description:
 - Executes a vRealize Orchestrator worklow by name or UUID
 - Optionally waits for workflows execution or just launches the workflow and continues
+- Optionally launches a batch of executions from a single task
 version_added: '2.6'
 author:
 - Tom Hite (@tdhite)
@@ -45,32 +46,353 @@ author:
 notes:
 - Tested on vRO 7.2.0.4629841
 options:
+   agent_socket:
+     description:
+     - path of the Unix socket of a C(vro_agent.py) agent to hand waits to, so that all forks share its connections and one poll of each workflow's executions listing per round
+     - when no agent answers on the socket the task polls vRO itself
+     - not used with C(log_file), which needs the task's own polling
+     required: false
+   batch:
+     description:
+     - list of executions to launch from a single task
+     - each item is a dictionary that may contain C(inputs), C(name) and C(uuid)
+     - items without C(name) or C(uuid) run the workflow given by the task level C(name) or C(uuid)
+     required: false
+   cache_file:
+     description:
+     - path of a JSON file that caches workflow name to UUID lookups between runs
+     - entries are keyed by C(hostname), C(port) and workflow name
+     - when not set lookups are only cached for the duration of the task
+     required: false
+   cache_invalidate:
+     description:
+     - ignore cached UUIDs and look every workflow name up again, refreshing the cache
+     required: false
+     default: no
+   cache_ttl:
+     description:
+     - seconds a cached workflow UUID is trusted
+     - a cached UUID that is rejected with 404 on launch is always looked up again
+     required: false
+     default: 86400
+   catalogue_file:
+     description:
+     - path of a JSON index of the workflows on the vRO appliance
+     - written when C(state=catalogued), read by other states to resolve workflow names and to validate C(inputs) names and types before launching
+     - an index older than C(cache_ttl) or built for another appliance is ignored
+     required: false
+   catalogue_page_size:
+     description:
+     - number of workflows fetched per page of the listing when building the index
+     required: false
+     default: 500
+   catalogue_signatures:
+     description:
+     - include the input-parameter signature of every workflow in the index
+     - this costs one request per workflow, made in parallel up to C(poll_concurrency)
+     required: false
+     default: yes
+   collect_until:
+     description:
+     - with C(state=collected) or C(state=resumed), C(all) waits for every execution to finish and C(any) returns as soon as one has finished
+     - with C(any), executions not polled before one had finished are returned with no C(status) and counted in C(pending)
+     required: false
+     default: all
+     choices: [ 'all', 'any' ]
+   endpoint_down_interval:
+     description:
+     - seconds a node of C(endpoints) that could not be reached, or answered 429 or 503, is skipped before it is probed again
+     required: false
+     default: 30
+   endpoint_strategy:
+     description:
+     - how new executions are spread across C(hostname) and C(endpoints)
+     - C(least_in_flight) launches on the healthy node with the fewest executions launched by the task still running, C(round_robin) on each healthy node in turn
+     required: false
+     default: least_in_flight
+     choices: [ 'least_in_flight', 'round_robin' ]
+   endpoints:
+     description:
+     - further nodes of the same vRO cluster, as C(host) or C(host:port), to spread executions across together with C(hostname)
+     - the state, logs and result of an execution are read from the node that launched it
+     - name lookups and other requests go to the first healthy node, and fail over to the next one when a node cannot be reached
+     - a launch only fails over when the node turned it away or it was never sent, so no execution is started twice
+     - names, UUIDs and caches are those of C(hostname), so the nodes must share one database
+     required: false
+   executions:
+     description:
+     - executions to collect when C(state=collected)
+     - items are dictionaries with C(execution_id) and C(workflow_id), such as the C(executions) returned by a batch run, or plain execution ids of the workflow given by C(name) or C(uuid)
+     required: false
    hostname:
      description:
      - ip or hostname of the vRO appliance
      required: true
+   idempotency:
+     description:
+     - reuse a completed execution of the workflow with the same inputs instead of launching a new one, returning its result with C(changed=false)
+     - inputs are compared by a digest of their canonical JSON, so the order of parameters and dictionary keys does not matter
+     - C(cache) looks the digest up in C(idempotency_file), C(history) compares it with the inputs of the last C(idempotency_history) completed runs of the workflow, C(both) tries the file first
+     - runs with C(SecureString) inputs are never matched against the history, as vRO does not return their values
+     required: false
+     default: 'off'
+     choices: [ 'off', 'cache', 'history', 'both' ]
+   idempotency_file:
+     description:
+     - path of a JSON file mapping input digests to the execution ids of completed runs, used by C(idempotency=cache) and C(idempotency=both)
+     - when not set completed runs are only remembered for the duration of the task
+     required: false
+   idempotency_history:
+     description:
+     - number of recent completed runs compared with the inputs by C(idempotency=history) and C(idempotency=both)
+     required: false
+     default: 20
+   idempotency_ttl:
+     description:
+     - seconds a completed run may be reused for, both from C(idempotency_file) and from the history
+     required: false
+     default: 3600
+   input_validation:
+     description:
+     - how C(inputs) are checked against the input parameters of the workflow before launching, so that mistakes fail the task instead of the execution
+     - C(catalogue) checks names and types, and coerces shorthand values, when the workflow is in C(catalogue_file)
+     - values in a C(parameters) list are sent in the envelope they are given in
+     - C(fetch) also fetches the input parameters of workflows missing from the index, caching them in C(cache_file) for C(cache_ttl)
+     - C(off) sends C(inputs) as given, typing shorthand values by their own type
+     - shorthand C(inputs) fetch the input parameters unless this is C(off)
+     required: false
+     default: catalogue
+     choices: [ 'off', 'catalogue', 'fetch' ]
    inputs:
      description:
      - parameters dictionary containg a list of parameter types and values
+     - a dictionary without a C(parameters) list is shorthand of input parameter names and plain values, compiled into vRO parameters typed by the workflow's input parameters
+     - shorthand values are coerced to C(string), C(SecureString), C(number), C(boolean) and C(Date) parameters, lists to C(Array/) parameters, dictionaries to C(Properties) and ids to inventory objects such as C(VC:VirtualMachine)
+     - in batch mode each item's inputs are compiled before the first execution is launched
+     required: false
+   journal_file:
+     description:
+     - path of an append-only journal of the executions launched by the task and of the end state of each, one JSON line per event
+     - after a controller failure, C(state=resumed) with the same journal waits on the executions left running instead of launching them again
+     required: false
+   journal_fsync:
+     description:
+     - C(batch) writes and fsyncs journal records at most every C(journal_fsync_interval) seconds, before waiting on executions and when the task ends
+     - C(always) writes and fsyncs every record as it happens, C(off) writes in batches but leaves syncing to the operating system
+     required: false
+     default: batch
+     choices: [ 'always', 'batch', 'off' ]
+   journal_fsync_interval:
+     description:
+     - seconds journal records may be buffered for with C(journal_fsync=batch) or C(journal_fsync=off)
+     required: false
+     default: 1
+   log_file:
+     description:
+     - path of a file the state changes and new log entries of the executions being waited on are appended to as they arrive, one line each, so progress can be followed with C(tail -f)
+     - only entries newer than those already written are fetched, at most every C(log_interval) seconds per execution and once more when it finishes
+     - failing to fetch a log is counted in C(log_stats) but does not fail the task
+     required: false
+   log_interval:
+     description:
+     - minimum seconds between fetches of the log of one execution
+     required: false
+     default: 10
+   log_page_size:
+     description:
+     - number of newest log entries fetched each time
+     - when more entries than this were written since the last fetch the older ones are skipped and a C(SKIPPED) line is written
+     required: false
+     default: 100
+   max_in_flight:
+     description:
+     - maximum number of executions launched by the task that may be running at once
+     - further launches wait, up to C(timeout), for an earlier execution to finish
+     - set to 0 for no limit
+     required: false
+     default: 0
+   max_results:
+     description:
+     - with C(state=reported) or C(state=analysed), the maximum number of runs to report or analyse
+     - set to 0 to report every matching run
+     required: false
+     default: 100
+   metrics:
+     description:
+     - time every vRO API call and return the timings, aggregated per endpoint, in C(metrics)
+     required: false
+     default: no
+   metrics_trace_file:
+     description:
+     - path of a file every vRO API call is appended to as one JSON object per line, for offline analysis
+     - setting it times the calls even when C(metrics) is off
      required: false
    name:
      description:
      - named of the vRO workflow to run
      required: False
+   password:
+     description:
+     - password for specified user
+     required: True
+   poll_backoff:
+     description:
+     - factor the interval between state polls grows by after each poll
+     required: false
+     default: 1.5
+   poll_concurrency:
+     description:
+     - maximum number of executions polled in parallel while waiting
+     - all executions share the single C(timeout) deadline
+     required: false
+     default: 8
+   poll_initial_interval:
+     description:
+     - seconds between the first state polls of an execution
+     required: false
+     default: 0.25
+   poll_jitter:
+     description:
+     - fraction by which each poll interval is randomly varied, so that many executions are not polled in lock step
+     required: false
+     default: 0.1
+   poll_max_interval:
+     description:
+     - upper limit in seconds of the interval between state polls
+     required: false
+     default: 5.0
+   poll_seed_from_history:
+     description:
+     - start polling at a tenth of the median duration of recent completed runs of the workflow
+     required: false
+     default: no
+   pool_idle_timeout:
+     description:
+     - seconds an idle keep-alive connection is kept before it is discarded
+     - keep this below the keep-alive timeout of the vRO appliance
+     required: false
+     default: 15
+   pool_size:
+     description:
+     - maximum number of keep-alive connections to the vRO appliance
+     - connections are reused for all requests made by the task
+     required: false
+     default: 8
    port:
      description:
      - listening API port
      required: false
      default: '8281'
-   password:
+   profile:
      description:
-     - password for specified user
-     required: True
+     - time the phases of the task, module import, argument processing, client setup, HTTP requests, JSON encoding and decoding, and waiting, and return the slowest in C(profile_stats)
+     required: false
+     default: no
+   profile_cprofile:
+     description:
+     - also run the task under cProfile and return its slowest functions in C(profile_stats)
+     - the cProfile stats are written to C(profile_dir) when it is set
+     - implies C(profile)
+     required: false
+     default: no
+   profile_dir:
+     description:
+     - directory a stack sample file of each run is written to, in the folded format read by flamegraph.pl and speedscope
+     - implies C(profile)
+     required: false
+   prometheus_textfile:
+     description:
+     - path of a node_exporter textfile collector file the task adds its Prometheus metrics to before returning its result
+     - failing to write the file does not fail the task, the error is returned in C(prometheus_textfile_error)
+     - launches, in-flight executions, execution duration histograms per workflow, finished executions by state including timeouts, and vRO API call counts and latency
+     - counters and histograms accumulate across tasks writing the same file
+     required: false
+   rate_limit:
+     description:
+     - maximum average number of requests per second sent to the vRO appliance, across launches, polls and result fetches
+     - set to 0 for no limit
+     required: false
+     default: 0
+   rate_limit_burst:
+     description:
+     - number of requests that may be sent at once before C(rate_limit) applies
+     - defaults to C(rate_limit)
+     required: false
+   required_inputs:
+     description:
+     - names of input parameters that must be given in C(inputs), or in the inputs of every batch item
+     - vRO does not report which inputs are mandatory, so they are listed here
+     required: false
+   result_fields:
+     description:
+     - output parameters kept in C(result), by name, or by type given as C(type:<type>) such as C(type:string)
+     - all output parameters are kept when not set
+     required: false
+   result_flatten:
+     description:
+     - replace the C(input-parameters) and C(output-parameters) lists of C(result) with C(inputs) and C(outputs) dictionaries of plain values keyed by parameter name
+     - vRO value envelopes such as C({string: {value: x}}) become C(x), arrays become lists and properties and composite types become dictionaries
+     required: false
+     default: no
+   result_inputs:
+     description:
+     - keep the input parameters, which can include SecureString values, in C(result)
+     required: false
+     default: yes
+   result_relations:
+     description:
+     - keep the C(relations) links of the execution document in C(result)
+     required: false
+     default: no
+   retries:
+     description:
+     - number of times a request is retried after a 429 or 503 response or a connection failure
+     - a launch is only retried when the appliance rejected it or it was never sent, so an execution is never started twice
+     required: false
+     default: 3
+   retry_interval:
+     description:
+     - seconds before the first retry, doubled for each later retry, with jitter
+     - a C(Retry-After) header sent by the appliance is used instead
+     required: false
+     default: 0.5
+   retry_max_interval:
+     description:
+     - upper limit in seconds of the wait before a retry
+     required: false
+     default: 30.0
+   run_state:
+     description:
+     - state of the runs listed by C(state=reported)
+     required: false
+     default: failed
+     choices: [ 'completed', 'failed', 'canceled', 'running', 'waiting', 'waiting-signal', 'suspended' ]
+   runs_since:
+     description:
+     - only runs started at or after this date are listed by C(state=reported) or analysed by C(state=analysed)
+     - an ISO 8601 date and time such as C(2018-06-01T00:00:00Z) or C(2018-06-01T09:30:00.000+01:00), UTC when no offset is given, or milliseconds since the epoch
+     required: false
+   runs_until:
+     description:
+     - only runs started at or before this date are listed by C(state=reported) or analysed by C(state=analysed)
+     - accepts the same formats as C(runs_since)
+     required: false
   state:
     description:
     - What state should the workflow be in?
+    - C(collected) gathers the final state and output of previously started C(executions)
+    - C(reported) lists recent runs of the workflow, by default the failed ones
+    - C(analysed) computes run statistics of the workflow over the runs selected by C(runs_since), C(runs_until) and C(max_results)
+    - C(catalogued) builds the C(catalogue_file) index instead of running a workflow
+    - C(resumed) collects the executions C(journal_file) shows were launched on C(hostname) or C(endpoints) and not seen finished, without launching anything
     required: False
-    choices: [ 'started' ]
+    choices: [ 'started', 'collected', 'reported', 'analysed', 'catalogued', 'resumed' ]
+   timeout_from_history:
+     description:
+     - replace C(timeout) with the timeout recommended by the statistics of the last 100 runs of the workflow
+     - C(timeout) is still used for workflows without completed runs
+     required: false
+     default: no
    username:
      description:
      - username to auth against api
@@ -87,8 +409,18 @@ options:
    wait_for_workflow:
      description:
      - Wait for the vRO workflow to complete.
+     - with C(state=collected) or C(state=resumed), C(no) reports the current state of the executions without waiting
      required: false
      default: yes
+   wait_strategy:
+     description:
+     - how the task learns that executions have finished
+     - C(state) polls the state of every execution
+     - C(listing) polls the executions listing of each workflow once per round, answering the state of all its executions with one request, and reads the detail of an execution missing from the listing or waited on alone
+     - C(listing) suits long running workflows and large batches, as requests scale with the number of workflows rather than executions
+     required: false
+     default: state
+     choices: [ 'state', 'listing' ]
 '''
 
 EXAMPLES = '''
@@ -107,6 +439,55 @@ EXAMPLES = '''
     username: vcoadmin
     password: vcoadmin
 
+- name: run a batch of vro workflow executions
+  vmware_vro_workflow:
+    name: test-workflow
+    hostname: vro.domain.local
+    username: vcoadmin
+    password: vcoadmin
+    batch:
+      - inputs: "{{ workflow_parameters_vm01 }}"
+      - inputs: "{{ workflow_parameters_vm02 }}"
+      - uuid: a7a1d06a-9018-40c4-9199-1ce95932311c
+
+- name: launch a batch of vro workflow executions without waiting
+  vmware_vro_workflow:
+    name: test-workflow
+    hostname: vro.domain.local
+    username: vcoadmin
+    password: vcoadmin
+    batch:
+      - inputs: "{{ workflow_parameters_vm01 }}"
+      - inputs: "{{ workflow_parameters_vm02 }}"
+    wait_for_workflow: no
+  register: vro_launched
+
+- name: collect the results of the launched executions later
+  vmware_vro_workflow:
+    state: collected
+    executions: "{{ vro_launched.executions }}"
+    hostname: vro.domain.local
+    username: vcoadmin
+    password: vcoadmin
+
+- name: wait on a large batch by polling the executions listing
+  vmware_vro_workflow:
+    name: test-workflow
+    hostname: vro.domain.local
+    username: vcoadmin
+    password: vcoadmin
+    batch: "{{ workflow_batch }}"
+    wait_strategy: listing
+    timeout: 7200
+
+- name: index the workflows of the vro appliance
+  vmware_vro_workflow:
+    state: catalogued
+    catalogue_file: ~/.ansible/vro/catalogue.json
+    hostname: vro.domain.local
+    username: vcoadmin
+    password: vcoadmin
+
 - name: run vRO workflow example playbook
   hosts: localhost
   connection: local
@@ -179,10 +560,292 @@ RETURN = '''
 
 The following return values are the fields unique to this module:
 
+agent_stats:
+  description: Waits handed to the C(agent_socket) agent
+  returned: when agent_socket is set
+  type: dict
+    waits:
+      description: waits answered by the agent
+      type: int
+    fallbacks:
+      description: waits polled by the task itself because no agent answered
+      type: int
+cache_stats:
+  description: Workflow name to UUID cache statistics
+  returned: always
+  type: dict
+    hits:
+      description: names resolved from the cache
+      type: int
+    misses:
+      description: names looked up on the vRO appliance
+      type: int
+    refreshed:
+      description: cached UUIDs dropped after the launch was rejected with 404
+      type: int
+    catalogue_hits:
+      description: names resolved from the C(catalogue_file) index
+      type: int
+    signatures_fetched:
+      description: workflow input parameters fetched from the vRO appliance rather than C(cache_file)
+      type: int
+catalogue:
+  description: Summary of the workflow index that was built
+  returned: when state is catalogued
+  type: dict
+    workflows:
+      description: number of workflows in the index
+      type: int
+    fetch_time:
+      description: seconds taken to fetch the listing and signatures
+      type: float
+    size:
+      description: size of the index file in bytes
+      type: int
+connection_stats:
+  description: Number of connections opened and requests sent to the vRO appliance
+  returned: always
+  type: dict
+    connections_opened:
+      description: HTTPS connections opened, including reconnects of closed keep-alive connections
+      type: int
+    requests_sent:
+      description: requests sent over those connections
+      type: int
+idempotency_stats:
+  description: Completed executions reused instead of launching the workflow again
+  returned: when idempotency is not off
+  type: dict
+    reused:
+      description: launches skipped because a completed run with the same inputs was found
+      type: int
+    cache_hits:
+      description: runs found in C(idempotency_file)
+      type: int
+    history_checked:
+      description: recent completed runs whose inputs were compared
+      type: int
+governor_stats:
+  description: Requests held back by the rate limit and in flight limit, and requests retried
+  returned: always
+  type: dict
+    throttled:
+      description: requests delayed by C(rate_limit)
+      type: int
+    throttle_wait:
+      description: total seconds requests were delayed by C(rate_limit)
+      type: float
+    retried:
+      description: requests retried after a 429 or 503 response or a connection failure
+      type: int
+    launches_held:
+      description: launches that waited for an execution to finish because of C(max_in_flight)
+      type: int
+endpoint_stats:
+  description: How executions were spread across the nodes
+  returned: when endpoints is set
+  type: dict
+    failovers:
+      description: requests sent to another node after one could not be reached or turned them away
+      type: int
+    strategy:
+      description: the C(endpoint_strategy) used
+      type: str
+    nodes:
+      description: per C(host:port), the executions C(launched), those still C(running), C(failures) and whether the node is C(healthy)
+      type: dict
 execution_id:
   description: The unique execution id of the specified workflow
-  returned: always
+  returned: always, except in batch mode
   type: on completion of an execution on the vro workflow
+journal_stats:
+  description: Journal records written by the task
+  returned: when journal_file is set
+  type: dict
+    file:
+      description: path of the journal
+      type: str
+    records:
+      description: launch and end state records written
+      type: int
+    syncs:
+      description: fsyncs of the journal
+      type: int
+log_stats:
+  description: Summary of the C(log_file) tail
+  returned: when log_file is set
+  type: dict
+    file:
+      description: path of the log file
+      type: str
+    entries:
+      description: log entries written
+      type: int
+    fetches:
+      description: log requests sent
+      type: int
+    truncated:
+      description: fetches that found more new entries than C(log_page_size)
+      type: int
+    errors:
+      description: log requests that failed
+      type: int
+metrics:
+  description: Timings of the vRO API calls, keyed by method and endpoint path with ids replaced by C({id})
+  returned: when metrics is enabled
+  type: dict
+    calls:
+      description: number of calls
+      type: int
+    bytes:
+      description: total size of the response bodies
+      type: int
+    status:
+      description: number of calls per HTTP status code
+      type: dict
+    mean:
+      description: mean seconds per call
+      type: float
+    max:
+      description: slowest call in seconds
+      type: float
+    dns:
+      description: total seconds spent in name lookups of new connections
+      type: float
+    connect:
+      description: total seconds spent in TCP connects of new connections
+      type: float
+    tls:
+      description: total seconds spent in TLS handshakes of new connections
+      type: float
+    first_byte:
+      description: total seconds until the response headers were received
+      type: float
+    total:
+      description: total seconds including reading the response body
+      type: float
+prometheus_textfile_error:
+  description: Why the metrics could not be written to C(prometheus_textfile), which does not fail the task
+  returned: when writing prometheus_textfile failed
+  type: str
+profile_stats:
+  description: Where the time of the task went
+  returned: when profile, profile_dir or profile_cprofile is set
+  type: dict
+    seconds:
+      description: seconds from the client setup to the result
+      type: float
+    phases:
+      description: the slowest phases, with their calls and total seconds across threads, nested phases overlap
+      type: list
+    top_functions:
+      description: the functions with the most cProfile self time
+      returned: when profile_cprofile is set
+      type: list
+    samples:
+      description: stack samples taken
+      returned: when profile_dir is set
+      type: int
+    stack_file:
+      description: path of the folded stack samples
+      returned: when profile_dir is set
+      type: str
+    cprofile_file:
+      description: path of the cProfile stats, readable with pstats
+      returned: when profile_dir and profile_cprofile are set
+      type: str
+    error:
+      description: why the files could not be written to C(profile_dir), which does not fail the task
+      returned: when writing to profile_dir failed
+      type: str
+poll_stats:
+  description: State polling statistics of the task
+  returned: always
+  type: dict
+    polls:
+      description: number of state polls sent
+      type: int
+    wasted_wait:
+      description: seconds slept before the polls that found executions finished, an upper bound of the latency added by polling
+      type: float
+    strategy:
+      description: the C(wait_strategy) used
+      type: str
+    requests_saved:
+      description: state polls avoided by reading several executions from one listing request
+      type: int
+executions:
+  description: Per item results of a batch run or collection, in the order of the batch or executions list
+  returned: in batch mode and when state is collected or resumed
+  type: list
+    execution_id:
+      description: The unique execution id of the item
+      type: str
+    reused:
+      description: C(true) when the item reused a completed execution rather than launching one
+      returned: when a completed execution was reused
+      type: bool
+    result:
+      description: Values representing the results of the workflow execution
+      returned: on successful execution on the vro workflow
+      type: complex
+    status:
+      description: The end status of the workflow execution
+      returned: when waiting for the workflow
+      type: str
+    workflow_id:
+      description: The unique ID of the workflow that was run
+      type: str
+runs:
+  description: Runs of the workflow matching C(run_state), newest first
+  returned: when state is reported
+  type: list
+    id:
+      description: execution id of the run
+      type: str
+    state:
+      description: state of the run
+      type: str
+    start_date:
+      description: start of the run as returned by vRO
+      type: str
+    end_date:
+      description: end of the run as returned by vRO
+      type: str
+statistics:
+  description: Run statistics of the workflow
+  returned: when state is analysed
+  type: complex
+    runs:
+      description: number of runs analysed
+      type: int
+    states:
+      description: number of runs in each state
+      type: dict
+    duration:
+      description: count, mean, max and p50, p90 and p99 percentiles of the durations in seconds of the completed runs
+      type: dict
+    throughput_per_hour:
+      description: runs started per hour over the analysed window
+      type: float
+    recommended_timeout:
+      description: timeout in seconds suggested by the p99 duration, as used by C(timeout_from_history)
+      type: int
+    recommended_poll_interval:
+      description: initial poll interval in seconds suggested by the p50 duration, as used by C(poll_seed_from_history)
+      type: float
+pending:
+  description: Number of collected executions that have not finished yet
+  returned: when state is collected or resumed
+  type: int
+already_finished:
+  description: Number of executions in the journal already seen finished, which were not collected again
+  returned: when state is resumed
+  type: int
+workflow_id:
+  description: The unique ID of the workflow that was run, for use with C(state=collected)
+  returned: always, except in batch mode
+  type: str
 result:
   description: Values representing the results of the workflow execution
   returned: on successful execution on the vro workflow
@@ -201,15 +864,23 @@ result:
       type: str
     input-parameters:
       description: list of dictionaries of input parameters
-      returned: on successful execution on the vro workflow
+      returned: on successful execution on the vro workflow, unless result_inputs is off or result_flatten is on
       type: list
+    inputs:
+      description: input parameter values keyed by name
+      returned: when result_flatten is on, unless result_inputs is off
+      type: dict
     output-parameters:
-      description: list of dictionaries of output parameters
-      returned: on successful execution on the vro workflow
+      description: list of dictionaries of the output parameters selected by C(result_fields)
+      returned: on successful execution on the vro workflow, unless result_flatten is on
       type: list
+    outputs:
+      description: values of the output parameters selected by C(result_fields), keyed by name
+      returned: when result_flatten is on
+      type: dict
     relations:
       description: returns a link list of related REST urls
-      returned: on successful execution on the vro workflow
+      returned: when result_relations is on
       type: dict
     start-date:
       description: epoch timestamp of the start of the workflow execution
@@ -223,6 +894,23 @@ result:
       description: state of the workflow execution
       returned: on successful execution on the vro workflow
       type: str
+reused:
+  description: C(true) when a completed execution with the same inputs was returned rather than launching the workflow
+  returned: when a completed execution was reused
+  type: bool
+result_stats:
+  description: Size of the execution documents fetched and of the results kept after C(result_fields) and the other result options
+  returned: always
+  type: dict
+    results:
+      description: execution documents fetched
+      type: int
+    bytes_fetched:
+      description: JSON size of the documents as fetched
+      type: int
+    bytes_kept:
+      description: JSON size of the results returned
+      type: int
 status:
   description: The end status of the workflow execution
   returned: on completion of an execution on the vro workflow
@@ -230,268 +918,387 @@ status:
 '''
 
 try:
-    import json
     import time
-    from urlparse import urlparse
+    IMPORT_START = time.time()
     from ansible.module_utils.basic import AnsibleModule
-    from ansible.module_utils.six.moves.urllib.error import HTTPError, URLError
-    from ansible.module_utils.urls import open_url
-    from ansible.module_utils.urls import ConnectionError, SSLValidationError
+    from ansible.module_utils.vmware_vro import VROClient, VROError, parse_vro_date
+    IMPORT_TIME = time.time() - IMPORT_START
     HAS_LIB = True
 except ImportError:
     HAS_LIB = False
 
 
-class VROClient(object):
-    """
-    vRO config
-    """
-
-    BASE_URL = "https://{}:{}/vco/{}"
-
-    def __init__(self, module):
-        self.module = module
-        self.user = self.module.params['username']
-        self.pwd = self.module.params['password']
-        self.server = self.module.params['hostname']
-        self.port = self.module.params['port']
-        self.headers = {'Content-Type': 'application/json',
-                        'Accept': 'application/json'}
-        self.validate_certs = self.module.params['validate_certs']
-        self.inputs = self.module.params['inputs']
-
-    def _api_url(self, path):
-        api_url_template = "api/{}"
-        api_path = api_url_template.format(path)
-        return self.BASE_URL.format(self.server, self.port, api_path)
-
-    def _fail(self, msg):
-        fail_msg = "Message: {}".format(msg)
-        self.module.fail_json(msg=fail_msg)
-
-    def _do_send(self, method, path, data=None):
-
-        url = self._api_url(path)
-
-        resp = None
-        if data is None and method == 'POST':
-            data = "{}"
-
-        try:
-            resp = open_url(
-                url, headers=self.headers,
-                url_username=self.user, url_password=self.pwd,
-                validate_certs=self.validate_certs,
-                method=method, force_basic_auth=True,
-                data=data)
-        except HTTPError as err:
-            self._fail("Received HTTP error: %s" % (str(err)))
-        except URLError as err:
-            self._fail("Failed lookup url: %s" % (str(err)))
-        except SSLValidationError as err:
-            self._fail("Error validating the server's certificate: %s" % (str(err)))
-        except ConnectionError as err:
-            self._fail("Error connecting: %s" % (str(err)))
-
-        raw_data = resp.read()
-        status_code = resp.getcode()
-        status_url = resp.geturl()
-        status_info = resp.info()
-
-        try:
-            if raw_data:
-                data = json.loads(raw_data)
-            else:
-                data = None
-        except TypeError:
-            fail_msg = "Unable to convert to JSON"
-            self._fail(fail_msg)
-
-        return status_code, status_url, status_info, data
-
-    def _do_get(self, path, data=None):
-        return self._do_send('GET', path, data)
-
-    def _do_post(self, path, data=None):
-        return self._do_send('POST', path, data)
-
-    def workflow_id(self, wf_name):
-
-        path = 'workflows?conditions=name={}'.format(wf_name)
-        wf_href = None
-
-        status_code, status_url, status_info, data = self._do_get(path)
-
-        if data:
-            wf_count = data['total']
-        else:
-            wf_count = 0
-
-        if wf_count == 0:
-            self._fail("Could not find workflow: {}".format(wf_name))
-        elif wf_count > 1:
-            self._fail("Cannot determine uniqueness.  "
-                       "Found {} instances of workflow: {}.".format(wf_count, wf_name))
-
-        for i in data['link']:
-            wf_href = [x['value'] for x in i['attributes'] if x['name'] == 'id'][0]
+def vro_client(module):
+    options = dict((name, module.params[name]) for name in VROClient.DEFAULTS
+                   if name in module.params)
+    options['max_in_flight_timeout'] = module.params['timeout']
+    return VROClient(module.params['hostname'], module.params['port'],
+                     module.params['username'], module.params['password'],
+                     **options)
 
-        return wf_href
 
-    def run_workflow(self, workflow_id, inputs):
-
-        path = "workflows/{}/executions/".format(workflow_id)
-
-        if inputs:        
-            try:
-                json_data = json.dumps(inputs)
-            except TypeError:
-                fail_msg = "Invalid inputs.  Unable to convert to JSON"
-                self._fail(fail_msg)
-        else:
-            json_data = None
+def run_catalogue(module, vro):
 
-        status_code, status_url, status_info, data = self._do_post(path, json_data)
+    start = time.time()
+    catalogue = vro.build_catalogue(module.params['catalogue_page_size'],
+                                    module.params['catalogue_signatures'])
+    fetch_time = time.time() - start
 
-        if status_code != 202:
-            fail_msg = "POST failed with status code: {}".format(status_code)
-            self._fail(fail_msg)
+    try:
+        size = catalogue.save(module.params['catalogue_file'], vro.server, vro.port)
+    except (IOError, OSError) as err:
+        module.fail_json(**vro.module_result(msg="Unable to write catalogue file: {}".format(err)))
 
-        url = status_info['location']
-        execution_id = urlparse(url).path.split('/')[-2]
+    module.exit_json(**vro.module_result(changed=True,
+                                         catalogue={'workflows': len(catalogue.workflows),
+                                                    'fetch_time': round(fetch_time, 3),
+                                                    'size': size}))
 
-        return execution_id
 
-    def run_workflow_state(self, workflow_id, execution_id):
+def run_collect(module, vro):
 
-        path = "workflows/{}/executions/{}/state".format(workflow_id, execution_id)
+    workflow_id = module.params['uuid']
+    if module.params['name']:
+        workflow_id = vro.workflow_id(module.params['name'])
 
-        status_code, status_url, status_info, data = self._do_get(path)
-
-        if status_code != 200:
-            fail_msg = "Failed to get state workflow: {} " \
-                       "execution id: {}".format(workflow_id, execution_id)
-            self._fail(fail_msg)
-
-        return data['value']
-
-    def run_workflow_result(self, workflow_id, execution_id):
+    executions = []
+    for item in module.params['executions']:
+        if isinstance(item, dict) and item.get('execution_id') and \
+                (item.get('workflow_id') or workflow_id):
+            executions.append({'workflow_id': item.get('workflow_id') or workflow_id,
+                               'execution_id': item['execution_id']})
+        elif not isinstance(item, dict) and workflow_id:
+            executions.append({'workflow_id': workflow_id,
+                               'execution_id': str(item)})
+        else:
+            module.fail_json(msg="Cannot determine workflow and execution id of: {}".format(item))
 
-        path = "workflows/{}/executions/{}/".format(workflow_id, execution_id)
+    timeout_value = vro.history_timeout([x['workflow_id'] for x in executions],
+                                        module.params['timeout'])
+    collected = vro.collect_workflows(executions, timeout_value,
+                                      wait=module.params['wait_for_workflow'],
+                                      until_any=module.params['collect_until'] == 'any')
 
-        status_code, status_url, status_info, data = self._do_get(path)
+    failed = [x for x in collected
+              if x['status'] in ('failed', 'canceled', 'timeout')]
+    pending = [x for x in collected if x['status'] not in vro.TERMINAL_STATES + ('timeout',)]
 
-        if status_code != 200:
-            fail_msg = "Failed to get state workflow: {} " \
-                       "execution id: {}".format(workflow_id, execution_id)
-            self._fail(fail_msg)
+    if failed:
+        module.fail_json(**vro.module_result(msg="{} of {} workflow executions did not complete"
+                                             .format(len(failed), len(collected)),
+                                             executions=collected, pending=len(pending)))
 
-        return data
+    module.exit_json(**vro.module_result(changed=False, executions=collected,
+                                         pending=len(pending)))
 
-    def wait_for_workflow(self, workflow_id, execution_id, timeout, sleep=2):
 
-        start = time.time()
-        timeout_exceded = False
+def run_resume(module, vro):
 
-        while not timeout_exceded:
-            workflow_state = self.run_workflow_state(workflow_id, execution_id)
+    collected, finished = vro.resume_workflows(module.params['timeout'],
+                                              wait=module.params['wait_for_workflow'],
+                                              until_any=module.params['collect_until'] == 'any')
 
-            if workflow_state in ('failed', 'completed', 'canceled'):
-                return workflow_state
+    failed = [x for x in collected
+              if x['status'] in ('failed', 'canceled', 'timeout')]
+    pending = [x for x in collected if x['status'] not in vro.TERMINAL_STATES + ('timeout',)]
 
-            else:
-                time.sleep(sleep)
+    if failed:
+        module.fail_json(**vro.module_result(msg="{} of {} resumed workflow executions did not complete"
+                                             .format(len(failed), len(collected)),
+                                             executions=collected, pending=len(pending),
+                                             already_finished=finished))
 
-            current = time.time()
+    module.exit_json(**vro.module_result(changed=False, executions=collected,
+                                         pending=len(pending),
+                                         already_finished=finished))
 
-            if (current - start) >= timeout:
-                return 'timeout'
 
-    def get_wf_run_status(self, workflow_id):
+def run_report(module, vro):
 
-        path = "workflows/{}/executions/".format(workflow_id)
+    workflow_id = module.params['uuid']
+    if module.params['name']:
+        workflow_id = vro.workflow_id(module.params['name'])
 
-        status_code, status_url, status_info, data = self._do_get(path)
+    runs = list(vro.iter_wf_runs(workflow_id, module.params['run_state'],
+                                 module.params['runs_since'],
+                                 module.params['runs_until'],
+                                 module.params['max_results']))
 
-        if status_code != 200:
-            self._fail("Failed getting runs for workflow: "
-                       "id: {}".format(workflow_id))
+    module.exit_json(**vro.module_result(changed=False, workflow_id=workflow_id,
+                                         runs=runs))
 
-        content = json.loads(data)
-        total = content['relations']['total']
 
-        if not total >= 1:
-            self._fail("No runs found for id: {} total: {}"
-                       .format(workflow_id, total))
+def run_analysis(module, vro):
 
-        wfruns = [i[x] for i in content['relations']['link'] for x in i.iterkeys() if x == 'attributes']
+    workflow_id = module.params['uuid']
+    if module.params['name']:
+        workflow_id = vro.workflow_id(module.params['name'])
 
-        failed_wfs = []
+    statistics = vro.workflow_statistics(workflow_id,
+                                         module.params['runs_since'],
+                                         module.params['runs_until'],
+                                         module.params['max_results'])
 
-        for wfrun in wfruns:
-            wfdata = {}
-            for i in wfrun:
-                for key in i.iterkeys():
-                    if i[key] in ('state', 'id', 'endDate'):
-                        wfdata.update({i[key]: i['value']})
+    module.exit_json(**vro.module_result(changed=False, workflow_id=workflow_id,
+                                         statistics=statistics))
 
-            if wfdata['state'] == 'failed':
-                failed_wfs.append(wfdata['id'])
 
-        return failed_wfs
+def run_single(module, vro):
+    workflow_name = module.params['name']
+    timeout_value = module.params['timeout']
+    workflow_id = module.params['uuid']
+    inp = module.params['inputs']
+    wait_workflow = module.params['wait_for_workflow']
 
+    if vro.idempotency != 'off':
+        if workflow_name:
+            workflow_id, execution_id = vro.named_workflow(
+                workflow_name, lambda x: vro.completed_execution(x, inp))
+        else:
+            execution_id = vro.completed_execution(workflow_id, inp)
+        if execution_id:
+            wf_result = vro.execution_result(workflow_id, execution_id)
+            module.exit_json(**vro.module_result(changed=False,
+                                                 reused=True,
+                                                 workflow_id=workflow_id,
+                                                 execution_id=execution_id,
+                                                 status='completed',
+                                                 result=wf_result))
+
+    if workflow_name:
+        workflow_id, execution_id = vro.run_workflow_named(workflow_name, inp)
+    else:
+        execution_id = vro.run_workflow(workflow_id, inp)
 
-def main():
-    argument_spec = dict(
+    if wait_workflow:
+        timeout_value = vro.history_timeout([workflow_id], timeout_value)
+        wf_status = vro.wait_for_workflow(workflow_id, execution_id,
+                                          timeout_value)
+
+        if wf_status == 'completed':
+            vro.remember_execution(workflow_id, inp, execution_id)
+            wf_result = vro.execution_result(workflow_id, execution_id)
+            module.exit_json(**vro.module_result(changed=True,
+                                                 workflow_id=workflow_id,
+                                                 execution_id=execution_id,
+                                                 status=wf_status,
+                                                 result=wf_result))
+        else:
+            module.fail_json(**vro.module_result(msg="Workflow status: {}".format(wf_status),
+                                                 workflow_id=workflow_id,
+                                                 execution_id=execution_id,
+                                                 status=wf_status))
+    else:
+        module.exit_json(**vro.module_result(changed=True,
+                                             workflow_id=workflow_id,
+                                             execution_id=execution_id))
+
+
+def run_batch(module, vro, batch):
+
+    for item in batch:
+        if not isinstance(item, dict):
+            module.fail_json(msg="Batch items must be dictionaries, got: {}".format(item))
+        unknown = set(item) - set(('name', 'uuid', 'inputs'))
+        if unknown:
+            module.fail_json(msg="Unsupported batch item keys: {}"
+                             .format(', '.join(sorted(unknown))))
+
+    executions = vro.run_workflows(batch,
+                                   workflow_name=module.params['name'],
+                                   workflow_id=module.params['uuid'])
+
+    changed = any(not x.get('reused') for x in executions)
+
+    if not module.params['wait_for_workflow']:
+        module.exit_json(**vro.module_result(changed=changed, executions=executions))
+
+    timeout_value = vro.history_timeout([x['workflow_id'] for x in executions],
+                                        module.params['timeout'])
+    states = vro.wait_for_workflows([(x['workflow_id'], x['execution_id'])
+                                     for x in executions],
+                                    timeout_value)
+
+    # run_workflows returns one execution per batch item, in order
+    for item, execution in zip(batch, executions):
+        wf_status = states[execution['execution_id']]
+        execution['status'] = wf_status
+        if wf_status == 'completed':
+            if not execution.get('reused'):
+                vro.remember_execution(execution['workflow_id'], item.get('inputs'),
+                                       execution['execution_id'])
+            execution['result'] = vro.execution_result(execution['workflow_id'],
+                                                       execution['execution_id'])
+
+    failed = [x for x in executions if x['status'] != 'completed']
+
+    if failed:
+        module.fail_json(**vro.module_result(msg="{} of {} workflow executions did not complete"
+                                             .format(len(failed), len(executions)),
+                                             executions=executions))
+
+    module.exit_json(**vro.module_result(changed=changed, executions=executions))
+
+
+def vro_argument_spec():
+    return dict(
         hostname=dict(required=True, type='str'),
         port=dict(required=False, type='str', default='8281'),
+        endpoints=dict(required=False, type='list'),
+        agent_socket=dict(required=False, type='path'),
+        endpoint_strategy=dict(required=False, type='str', default='least_in_flight',
+                               choices=['least_in_flight', 'round_robin']),
+        endpoint_down_interval=dict(required=False, type='int', default=30),
         username=dict(required=True, type='str'),
         password=dict(required=True, type='str', no_log=True),
         name=dict(required=False, type='str'),
         uuid=dict(required=False, type='str'),
         inputs=dict(required=False, type='dict'),
+        input_validation=dict(required=False, type='str', default='catalogue',
+                              choices=['off', 'catalogue', 'fetch']),
+        required_inputs=dict(required=False, type='list'),
+        batch=dict(required=False, type='list'),
+        executions=dict(required=False, type='list'),
+        collect_until=dict(required=False, type='str', default='all',
+                           choices=['all', 'any']),
+        run_state=dict(required=False, type='str', default='failed',
+                       choices=['completed', 'failed', 'canceled', 'running', 'waiting',
+                                'waiting-signal', 'suspended']),
+        runs_since=dict(required=False, type='str'),
+        runs_until=dict(required=False, type='str'),
+        max_results=dict(required=False, type='int', default=100),
+        cache_file=dict(required=False, type='path'),
+        cache_ttl=dict(required=False, type='int', default=86400),
+        cache_invalidate=dict(required=False, type='bool', default=False),
+        catalogue_file=dict(required=False, type='path'),
+        catalogue_page_size=dict(required=False, type='int', default=500),
+        catalogue_signatures=dict(required=False, type='bool', default=True),
+        idempotency=dict(required=False, type='str', default='off',
+                         choices=['off', 'cache', 'history', 'both']),
+        idempotency_file=dict(required=False, type='path'),
+        idempotency_ttl=dict(required=False, type='int', default=3600),
+        idempotency_history=dict(required=False, type='int', default=20),
         state=dict(type='str', default='started',
-                   choices=['started']),
+                   choices=['started', 'collected', 'reported', 'analysed',
+                            'catalogued', 'resumed']),
         timeout=dict(required=False, type='int', default=600),
+        poll_concurrency=dict(required=False, type='int', default=8),
+        poll_initial_interval=dict(required=False, type='float', default=0.25),
+        poll_max_interval=dict(required=False, type='float', default=5.0),
+        poll_backoff=dict(required=False, type='float', default=1.5),
+        poll_jitter=dict(required=False, type='float', default=0.1),
+        poll_seed_from_history=dict(required=False, type='bool', default=False),
+        timeout_from_history=dict(required=False, type='bool', default=False),
+        pool_size=dict(required=False, type='int', default=8),
+        pool_idle_timeout=dict(required=False, type='int', default=15),
+        metrics=dict(required=False, type='bool', default=False),
+        metrics_trace_file=dict(required=False, type='path'),
+        prometheus_textfile=dict(required=False, type='path'),
+        profile=dict(required=False, type='bool', default=False),
+        profile_dir=dict(required=False, type='path'),
+        profile_cprofile=dict(required=False, type='bool', default=False),
+        rate_limit=dict(required=False, type='float', default=0),
+        rate_limit_burst=dict(required=False, type='int'),
+        max_in_flight=dict(required=False, type='int', default=0),
+        retries=dict(required=False, type='int', default=3),
+        retry_interval=dict(required=False, type='float', default=0.5),
+        retry_max_interval=dict(required=False, type='float', default=30.0),
+        result_fields=dict(required=False, type='list'),
+        result_flatten=dict(required=False, type='bool', default=False),
+        result_inputs=dict(required=False, type='bool', default=True),
+        result_relations=dict(required=False, type='bool', default=False),
+        journal_file=dict(required=False, type='path'),
+        journal_fsync=dict(required=False, type='str', default='batch',
+                           choices=['always', 'batch', 'off']),
+        journal_fsync_interval=dict(required=False, type='float', default=1.0),
+        log_file=dict(required=False, type='path'),
+        log_interval=dict(required=False, type='float', default=10.0),
+        log_page_size=dict(required=False, type='int', default=100),
+        wait_strategy=dict(required=False, type='str', default='state',
+                           choices=['state', 'listing']),
         validate_certs=dict(required=False, type='bool', default=True),
         wait_for_workflow=dict(required=False, type='bool', default=True)
     )
 
+
+def main():
+    argument_spec = vro_argument_spec()
+
+    start = time.time()
     module = AnsibleModule(argument_spec=argument_spec,
                            supports_check_mode=False,
-                           required_one_of=[['name', 'uuid']])
+                           required_if=[['state', 'catalogued', ['catalogue_file']],
+                                        ['state', 'resumed', ['journal_file']],
+                                        ['state', 'collected', ['executions']]],
+                           mutually_exclusive=[['inputs', 'batch']])
+    arguments_time = time.time() - start
 
     if not HAS_LIB:
         module.fail_json(msg='python modules failed \
                               to import required for this module')
 
-    vro = VROClient(module)
-
-    if module.params['state'] == 'started':
-        workflow_name = module.params['name']
-        timeout_value = module.params['timeout']
-        workflow_id = module.params['uuid']
-        inp = module.params['inputs']
-        wait_workflow = module.params['wait_for_workflow']
-
-        if workflow_name:
-            workflow_id = vro.workflow_id(workflow_name)
-
-        execution_id = vro.run_workflow(workflow_id, inp)
-
-        if wait_workflow:
-            wf_status = vro.wait_for_workflow(workflow_id, execution_id,
-                                              timeout_value)
-
-            if wf_status == 'completed':
-                wf_result = vro.run_workflow_result(workflow_id, execution_id)
-                module.exit_json(changed=True, execution_id=execution_id,
-                                 status=wf_status, result=wf_result)
-            else:
-                module.fail_json(msg="Workflow status: {}".format(wf_status),
-                                 execution_id=execution_id, status=wf_status)
-        else:
-            module.exit_json(changed=True, execution_id=execution_id)
+    if module.params['poll_initial_interval'] <= 0:
+        module.fail_json(msg="poll_initial_interval must be greater than 0")
+    if module.params['poll_max_interval'] < module.params['poll_initial_interval']:
+        module.fail_json(msg="poll_max_interval must not be less than poll_initial_interval")
+    if module.params['poll_backoff'] < 1:
+        module.fail_json(msg="poll_backoff must be 1 or greater")
+    if not 0 <= module.params['poll_jitter'] < 1:
+        module.fail_json(msg="poll_jitter must be between 0 and 1")
+    for name in ('rate_limit', 'max_in_flight', 'retries', 'retry_interval'):
+        if module.params[name] < 0:
+            module.fail_json(msg="{} must not be negative".format(name))
+    if module.params['idempotency_ttl'] < 1:
+        module.fail_json(msg="idempotency_ttl must be 1 or greater")
+    if module.params['log_page_size'] < 1:
+        module.fail_json(msg="log_page_size must be 1 or greater")
+    if module.params['pool_size'] < 1:
+        module.fail_json(msg="pool_size must be 1 or greater")
+    if module.params['poll_concurrency'] < 1:
+        module.fail_json(msg="poll_concurrency must be 1 or greater")
+    if module.params['rate_limit_burst'] is not None and module.params['rate_limit_burst'] < 1:
+        module.fail_json(msg="rate_limit_burst must be 1 or greater")
+    for name in ('runs_since', 'runs_until'):
+        if module.params[name] is not None and parse_vro_date(module.params[name]) is None:
+            module.fail_json(msg="{} is not an ISO 8601 date and time: {}".format(
+                name, module.params[name]))
+
+    start = time.time()
+    try:
+        vro = vro_client(module)
+    except (IOError, OSError) as err:
+        module.fail_json(msg="Unable to open file: {}".format(err))
+
+    if vro.profiler:
+        vro.profiler.add('module_import', IMPORT_TIME)
+        vro.profiler.add('arguments', arguments_time)
+        vro.profiler.add('client', time.time() - start)
+
+    try:
+        if module.params['state'] == 'catalogued':
+            run_catalogue(module, vro)
+
+        if module.params['state'] == 'collected':
+            run_collect(module, vro)
+
+        if module.params['state'] == 'resumed':
+            run_resume(module, vro)
+
+        if module.params['state'] in ('reported', 'analysed'):
+            if not (module.params['name'] or module.params['uuid']):
+                module.fail_json(msg="one of the following is required: name, uuid")
+            if module.params['state'] == 'reported':
+                run_report(module, vro)
+            run_analysis(module, vro)
+
+        if module.params['state'] == 'started':
+            if not (module.params['name'] or module.params['uuid'] or module.params['batch']):
+                module.fail_json(msg="one of the following is required: name, uuid, batch")
+            if module.params['batch'] is not None:
+                run_batch(module, vro, module.params['batch'])
+            run_single(module, vro)
+    except VROError as err:
+        module.fail_json(**vro.module_result(msg=str(err)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,2753 @@
+# Copyright (c) 2018 Tony Skidmore (@tonyskidmore) <tony@skidmore.co.uk>
+# Copyright (c) 2015 Tom Hite (@tdhite)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Client used by the vmware_vro_workflow module, shared with other Python
+# tooling that drives vRO workflows.
+#
+# This module is based on the original work by Tom Hite at VMware
+# vcenter_vro_config.py as part of ansible-module-chaperone
+# https://github.com/vmware/ansible-module-chaperone
+#
+#
+# 2018 Tony Skidmore, <tony@skidmore.co.uk>
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import atexit
+import base64
+import calendar
+import hashlib
+import heapq
+import json
+import math
+import os
+import random
+import re
+import select
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+try:
+    from http import client as http_client
+    from urllib.parse import urlparse
+except ImportError:
+    import httplib as http_client
+    from urlparse import urlparse
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    STRING_TYPES = (basestring,)
+except NameError:
+    STRING_TYPES = (str,)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+ISO_DATE = r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?(Z|[+-]\d\d:?\d\d)?'
+
+
+class VROError(Exception):
+    """
+    vRO API failure, reported by the Ansible module through fail_json
+    """
+
+    def __init__(self, msg, status=None):
+        super(VROError, self).__init__(msg)
+        self.status = status
+
+
+class WorkflowIdCache(object):
+    """
+    Workflow name to UUID lookups, kept in memory for the life of the cache
+    and optionally persisted to a JSON file shared with later runs.  Failing
+    to read or write the file, or malformed entries in it, only cost the
+    lookup, never the task.
+    """
+
+    def __init__(self, path=None, ttl=86400):
+        self.path = os.path.expanduser(path) if path else None
+        self.ttl = ttl
+        self.memory = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+
+    @staticmethod
+    def key(server, port, name):
+        return "{}:{}:{}".format(server, port, name)
+
+    def _read(self):
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return dict((k, v) for k, v in entries.items()
+                    if isinstance(v, dict) and 'id' in v and
+                    isinstance(v.get('time'), (int, float)))
+
+    def _load(self):
+        if self.loaded or not self.path:
+            return
+        self.loaded = True
+        for key, entry in self._read().items():
+            if key not in self.memory or self.memory[key]['time'] < entry['time']:
+                self.memory[key] = entry
+
+    def _save(self, key):
+        if not self.path:
+            return
+        now = time.time()
+        entries = dict((k, v) for k, v in self._read().items()
+                       if now - v['time'] < self.ttl)
+        if key in self.memory:
+            entries[key] = self.memory[key]
+        else:
+            entries.pop(key, None)
+        try:
+            cache_dir = os.path.dirname(self.path) or '.'
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def get(self, key):
+        with self.lock:
+            self._load()
+            entry = self.memory.get(key)
+            if entry and time.time() - entry['time'] < self.ttl:
+                self.hits += 1
+                return entry['id']
+            self.misses += 1
+            return None
+
+    def set(self, key, workflow_id):
+        with self.lock:
+            self._load()
+            self.memory[key] = {'id': workflow_id, 'time': time.time()}
+            self._save(key)
+
+    def invalidate(self, key):
+        with self.lock:
+            self._load()
+            self.memory.pop(key, None)
+            self.refreshed += 1
+            self._save(key)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'refreshed': self.refreshed}
+
+
+def fail(msg, status=None):
+    raise VROError("Message: {}".format(msg), status)
+
+
+def link_attributes(link):
+    """
+    Attributes of a vRO listing link as a dictionary
+    """
+    return dict((x['name'], x.get('value')) for x in link.get('attributes', []))
+
+
+def run_summary(link):
+    """
+    Summary of one run from a link of the executions listing
+    """
+    attrs = link_attributes(link)
+    return {'id': attrs.get('id'),
+            'state': attrs.get('state'),
+            'start_date': attrs.get('startDate'),
+            'end_date': attrs.get('endDate')}
+
+
+class RunFilter(object):
+    """
+    Selects run summaries from pages of the executions listing, newest
+    first, and flags when no later page can match
+    """
+
+    def __init__(self, run_state=None, since=None, until=None,
+                 max_results=None, page_size=100):
+        self.run_state = run_state
+        self.since = parse_vro_date(since)
+        self.until = parse_vro_date(until)
+        self.max_results = max_results
+        self.page_size = min(page_size, max_results) if max_results else page_size
+        self.found = 0
+        self.done = False
+
+    def select(self, links):
+        for link in links:
+            run = run_summary(link)
+            started = parse_vro_date(run['start_date'])
+            if self.since and started is not None and started < self.since:
+                self.done = True
+                return
+            if self.until and started is not None and started > self.until:
+                continue
+            if self.run_state and run['state'] != self.run_state:
+                continue
+            yield run
+            self.found += 1
+            if self.max_results and self.found >= self.max_results:
+                self.done = True
+                return
+
+
+def runs_path(workflow_id, page_size, start, run_state=None):
+    path = "workflows/{}/executions/?maxResult={}&startIndex={}" \
+           "&sortOrder=-startDate".format(workflow_id, page_size, start)
+    if run_state:
+        path += "&conditions=state={}".format(run_state)
+    return path
+
+
+def workflow_id_from_listing(wf_name, data):
+    """
+    UUID of the single workflow in a workflows?conditions=name= listing
+    """
+    wf_href = None
+
+    if data:
+        wf_count = data['total']
+    else:
+        wf_count = 0
+
+    if wf_count == 0:
+        fail("Could not find workflow: {}".format(wf_name))
+    elif wf_count > 1:
+        fail("Cannot determine uniqueness.  "
+             "Found {} instances of workflow: {}.".format(wf_count, wf_name))
+
+    for i in data['link']:
+        wf_href = [x['value'] for x in i['attributes'] if x['name'] == 'id'][0]
+
+    return wf_href
+
+
+def inputs_json(inputs):
+    if not inputs:
+        return None
+    try:
+        return json.dumps(inputs)
+    except TypeError:
+        fail("Invalid inputs.  Unable to convert to JSON")
+
+
+SCALAR_ENVELOPES = {'string': 'string', 'Text': 'string',
+                    'SecureString': 'secure-string', 'number': 'number',
+                    'boolean': 'boolean', 'Date': 'date'}
+BOOLEAN_STRINGS = {'true': True, 'yes': True, 'on': True, '1': True,
+                   'false': False, 'no': False, 'off': False, '0': False}
+
+
+def value_type(value):
+    """
+    vRO type of a plain value, for parameters whose type is not known
+    """
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, (list, tuple)):
+        return 'Array/' + (value_type(value[0]) if value else 'string')
+    if isinstance(value, dict):
+        return 'Properties'
+    return 'string'
+
+
+def parameter_value(param_type, value, name):
+    """
+    vRO value envelope of a plain value, coerced to param_type
+    """
+    expected = "Input parameter {} is of type {}, got: {}".format(name, param_type, value)
+
+    if param_type in ('string', 'Text', 'SecureString'):
+        if isinstance(value, (dict, list, tuple)) or value is None:
+            fail(expected)
+        if not isinstance(value, STRING_TYPES):
+            value = json.dumps(value)
+    elif param_type == 'number':
+        if isinstance(value, bool):
+            fail(expected)
+        if not isinstance(value, (int, float)):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                fail(expected)
+    elif param_type == 'boolean':
+        if not isinstance(value, bool):
+            value = BOOLEAN_STRINGS.get(str(value).lower())
+            if value is None:
+                fail(expected)
+    elif param_type == 'Date':
+        if not isinstance(value, STRING_TYPES) or not re.match(ISO_DATE, value):
+            fail(expected)
+    elif param_type.startswith('Array/'):
+        if not isinstance(value, (list, tuple)):
+            fail(expected)
+        return {'array': {'elements': [parameter_value(param_type[6:], x, name)
+                                       for x in value]}}
+    elif param_type == 'Properties':
+        if not isinstance(value, dict):
+            fail(expected)
+        return {'properties': {'property': [
+            {'key': k, 'value': parameter_value(value_type(v), v, name)}
+            for k, v in sorted(value.items())]}}
+    elif ':' in param_type:
+        if not isinstance(value, STRING_TYPES):
+            fail(expected)
+        return {'sdk-object': {'type': param_type, 'id': value}}
+    else:
+        fail("Input parameter {} is of type {}, which cannot be given as a plain value"
+             .format(name, param_type))
+
+    return {SCALAR_ENVELOPES[param_type]: {'value': value}}
+
+
+def compile_inputs(inputs, signature=None):
+    """
+    Inputs in vRO's parameter envelope.  Inputs without a parameters list are
+    the name: value shorthand and are compiled to envelopes, typed by the
+    signature or else by their values.  With a signature, names and types
+    are checked and shorthand values coerced to the parameter types.  Values
+    given in a parameters list keep the envelope they were given in.
+    """
+    if not inputs:
+        return inputs
+
+    types = None
+    if signature is not None:
+        types = dict((x['name'], x['type']) for x in signature)
+
+    plain = not isinstance(inputs.get('parameters'), list)
+    if plain:
+        given = [{'name': name, 'scope': 'local', 'value': value}
+                 for name, value in sorted(inputs.items())]
+    else:
+        given = inputs['parameters']
+
+    parameters = []
+    for param in given:
+        param = dict(param)
+        name = param.get('name')
+        if types is not None:
+            if name not in types:
+                fail("Workflow has no input parameter: {}".format(name))
+            if param.get('type') and param['type'] != types[name]:
+                fail("Input parameter {} is of type {}, not {}"
+                     .format(name, types[name], param['type']))
+            param['type'] = types[name]
+        if plain:
+            param['type'] = param.get('type') or value_type(param['value'])
+            param['value'] = parameter_value(param['type'], param['value'], name)
+        parameters.append(param)
+
+    return {'parameters': parameters}
+
+
+def execution_id_from_location(url):
+    return urlparse(url).path.split('/')[-2]
+
+
+def flatten_value(value):
+    """
+    Plain value of a vRO parameter value envelope such as
+    {'string': {'value': 'x'}}, recursing into arrays, properties and
+    composite types
+    """
+    if not isinstance(value, dict) or len(value) != 1:
+        return value
+    kind, inner = list(value.items())[0]
+    if not isinstance(inner, dict):
+        return inner
+    if kind == 'array':
+        return [flatten_value(x) for x in inner.get('elements', [])]
+    if kind == 'properties':
+        return dict((x.get('key'), flatten_value(x.get('value')))
+                    for x in inner.get('property', []))
+    if kind == 'composite':
+        return dict((x.get('id'), flatten_value(x.get('value')))
+                    for x in inner.get('property', []))
+    if 'value' in inner:
+        return inner['value']
+    return inner
+
+
+def select_parameters(parameters, fields):
+    """
+    Parameters whose name is in fields, or whose type is, given as type:<type>
+    """
+    if not fields:
+        return parameters
+    names = set(x for x in fields if not x.startswith('type:'))
+    types = set(x[5:] for x in fields if x.startswith('type:'))
+    return [x for x in parameters
+            if x.get('name') in names or x.get('type') in types]
+
+
+def project_result(data, fields=None, flatten=False, inputs=True, relations=False):
+    """
+    Trim an execution document to what the caller asked for: the output
+    parameters selected by fields, optionally flattened to a name to value
+    dictionary, without relations and, if asked, without input parameters
+    """
+    if not isinstance(data, dict):
+        return data
+    result = dict((k, v) for k, v in data.items()
+                  if k not in ('relations', 'input-parameters', 'output-parameters'))
+    if relations and 'relations' in data:
+        result['relations'] = data['relations']
+
+    outputs = select_parameters(data.get('output-parameters', []), fields)
+    if flatten:
+        result['outputs'] = dict((x.get('name'), flatten_value(x.get('value')))
+                                 for x in outputs)
+    else:
+        result['output-parameters'] = outputs
+
+    if inputs:
+        if flatten:
+            result['inputs'] = dict((x.get('name'), flatten_value(x.get('value')))
+                                    for x in data.get('input-parameters', []))
+        else:
+            result['input-parameters'] = data.get('input-parameters', [])
+
+    return result
+
+
+def canonical_parameters(parameters):
+    """
+    Input parameters reduced to sorted (name, type, plain value) triples, so
+    that the inputs given to a launch and those recorded on an execution
+    compare equal whatever their key order, scope or number formatting
+    """
+    canonical = []
+    for param in parameters or []:
+        value = flatten_value(param.get('value'))
+        if param.get('type') == 'number':
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                pass
+        canonical.append([param.get('name'), param.get('type'), value])
+    return sorted(canonical, key=lambda x: str(x[0]))
+
+
+def inputs_digest(workflow_id, inputs):
+    """
+    SHA-256 of the workflow UUID and the canonical form of its inputs
+    """
+    payload = json.dumps([workflow_id,
+                          canonical_parameters((inputs or {}).get('parameters'))],
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def parse_vro_date(value):
+    """
+    Convert a vRO date, either epoch milliseconds or ISO 8601, to epoch seconds
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value) / 1000.0
+
+    match = re.match(ISO_DATE, str(value))
+    if not match:
+        return None
+
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    epoch = calendar.timegm((int(year), int(month), int(day),
+                             int(hour), int(minute), int(second)))
+    if fraction:
+        epoch += float('0.' + fraction)
+    if offset and offset != 'Z':
+        sign = -1 if offset[0] == '+' else 1
+        offset = offset[1:].replace(':', '')
+        epoch += sign * (int(offset[:2]) * 3600 + int(offset[2:]) * 60)
+
+    return epoch
+
+
+def percentile(values, fraction):
+    """
+    Linearly interpolated percentile of an already sorted sequence
+    """
+    if not values:
+        return None
+    rank = (len(values) - 1) * fraction
+    lower = int(math.floor(rank))
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def run_statistics(states, durations, first, last):
+    """
+    Summarise run counts by state and an array of completed run durations,
+    with the timeout and poll interval they suggest
+    """
+    durations = array('d', sorted(durations))
+    p50 = percentile(durations, 0.5)
+    p99 = percentile(durations, 0.99)
+    runs = sum(states.values())
+
+    window = (last - first) / 3600.0 if first is not None and last is not None else 0
+    stats = {'runs': runs,
+             'states': states,
+             'duration': {'count': len(durations),
+                          'mean': sum(durations) / len(durations) if durations else None,
+                          'max': durations[-1] if durations else None,
+                          'p50': p50,
+                          'p90': percentile(durations, 0.9),
+                          'p99': p99},
+             'throughput_per_hour': runs / window if window > 0 else None,
+             'recommended_timeout': None,
+             'recommended_poll_interval': None}
+
+    if durations:
+        stats['recommended_timeout'] = int(math.ceil(max(p99 * 1.5, p99 + 30)))
+        stats['recommended_poll_interval'] = round(max(p50 / 10.0, 0.25), 3)
+
+    return stats
+
+
+class PollScheduler(object):
+    """
+    Intervals between state polls of one execution: fast initial polls that
+    back off exponentially, with jitter, towards a cap.  Replace
+    VROClient.scheduler_class to plug in another schedule.
+    """
+
+    def __init__(self, initial=0.25, maximum=5.0, backoff=1.5, jitter=0.1):
+        self.initial = initial
+        self.maximum = maximum
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = initial
+
+    def seed(self, expected_duration):
+        if expected_duration:
+            self.interval = min(max(expected_duration / 10.0, self.initial),
+                                self.maximum)
+
+    def next_interval(self):
+        interval = self.interval
+        self.interval = min(self.interval * self.backoff, self.maximum)
+        if self.jitter:
+            interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(interval, self.maximum)
+
+
+class TokenBucket(object):
+    """
+    Client side request rate limit: rate requests per second on average, in
+    bursts of up to burst requests
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return the seconds to wait before it may be used.
+        Tokens are handed out in order, so waiting callers are not starved.
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RetryPolicy(object):
+    """
+    Which failed requests are retried, and after how long.  Requests the
+    appliance turned away with 429 or 503 are always safe to repeat; a
+    connection failure is only retried for a GET or for a request that was
+    never sent, so an execution is never launched twice.
+    """
+
+    RETRY_STATUS = (429, 503)
+
+    def __init__(self, retries=3, initial=0.5, maximum=30.0):
+        self.retries = retries
+        self.initial = initial
+        self.maximum = maximum
+
+    def retry_status(self, attempt, status):
+        return attempt < self.retries and status in self.RETRY_STATUS
+
+    def retry_error(self, attempt, method, err):
+        return attempt < self.retries and \
+            (method == 'GET' or not getattr(err, 'request_sent', True))
+
+    def delay(self, attempt, retry_after=None):
+        try:
+            if retry_after is not None:
+                return min(max(float(retry_after), 0.0), self.maximum)
+        except ValueError:
+            pass
+        interval = min(self.initial * 2 ** attempt, self.maximum)
+        return random.uniform(interval / 2, interval)
+
+
+class ExecutionLogTail(object):
+    """
+    Appends the state changes and log entries of executions being waited on
+    to a file as they arrive.  Only the timestamp of the newest entry written
+    and how many entries share it are kept per execution, so memory does not
+    grow with the volume of the logs.
+    """
+
+    def __init__(self, path, interval=10.0, page_size=100):
+        self.path = os.path.expanduser(path)
+        self.interval = interval
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.fetched = {}
+        self.states = {}
+        self.entries = 0
+        self.fetches = 0
+        self.truncated = 0
+        self.errors = 0
+        self.output = open(self.path, 'a')
+        atexit.register(self.close)
+
+    def due(self, execution_id, final=False):
+        """
+        Whether the log of the execution should be fetched now, claiming the
+        fetch if so
+        """
+        now = time.time()
+        with self.lock:
+            if not final and now - self.fetched.get(execution_id, 0) < self.interval:
+                return False
+            self.fetched[execution_id] = now
+            self.fetches += 1
+            return True
+
+    def _write(self, lines):
+        self.output.write(''.join(x + "\n" for x in lines))
+        self.output.flush()
+
+    def state(self, execution_id, workflow_state):
+        with self.lock:
+            if workflow_state is None or self.states.get(execution_id) == workflow_state:
+                return
+            self.states[execution_id] = workflow_state
+            self._write(["{} {} STATE {}".format(
+                time.strftime('%Y-%m-%dT%H:%M:%S%z'), execution_id, workflow_state)])
+
+    def append(self, execution_id, logs):
+        """
+        Write the entries of one page of the execution's log that are newer
+        than those already written
+        """
+        entries = []
+        for item in logs:
+            entry = item.get('entry', item)
+            entries.append((parse_vro_date(entry.get('time-stamp')) or 0, entry))
+        entries.sort(key=lambda x: x[0])
+
+        with self.lock:
+            last, written = self.offsets.get(execution_id, (None, 0))
+            lines = []
+            new = 0
+            if len(entries) >= self.page_size and \
+                    (last is None and execution_id in self.offsets or
+                     last is not None and entries[0][0] > last):
+                self.truncated += 1
+                lines.append("{} {} SKIPPED older entries beyond log_page_size"
+                             .format(entries[0][1].get('time-stamp'), execution_id))
+            for stamp, entry in entries:
+                if last is not None and stamp < last:
+                    continue
+                if stamp == last:
+                    if written:
+                        written -= 1
+                        continue
+                new += 1
+                lines.append("{} {} {} [{}] {}".format(
+                    entry.get('time-stamp'), execution_id,
+                    str(entry.get('severity', 'info')).upper(), entry.get('origin', ''),
+                    entry.get('short-description', '')))
+            if entries:
+                newest = entries[-1][0]
+                same = len([x for x in entries if x[0] == newest])
+                self.offsets[execution_id] = (newest, same)
+            else:
+                self.offsets.setdefault(execution_id, (None, 0))
+            self.entries += new
+            if lines:
+                self._write(lines)
+
+    def close(self):
+        with self.lock:
+            self.output.close()
+
+    def stats(self):
+        return {'file': self.path, 'entries': self.entries,
+                'fetches': self.fetches, 'truncated': self.truncated,
+                'errors': self.errors}
+
+
+class ExecutionJournal(object):
+    """
+    Append-only record of the executions launched and of the end state of
+    each, one JSON object per line, so that a later task can find the
+    executions a dead controller left running.  Records are buffered and
+    written, then fsynced as fsync asks, at most every interval seconds and
+    when the process exits; fsync=always writes every record at once.
+    """
+
+    def __init__(self, path, fsync='batch', interval=1.0):
+        self.path = os.path.expanduser(path)
+        self.fsync = fsync
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.flushed = time.time()
+        self.records = 0
+        self.syncs = 0
+        journal_dir = os.path.dirname(self.path) or '.'
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        self.output = open(self.path, 'a')
+        atexit.register(self.close)
+
+    def _record(self, record):
+        record['time'] = round(time.time(), 3)
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self.lock:
+            self.buffer.append(line)
+            self.records += 1
+            if self.fsync == 'always' or time.time() - self.flushed >= self.interval:
+                self._flush()
+
+    def _flush(self):
+        if self.buffer and not self.output.closed:
+            self.output.write(''.join(self.buffer))
+            self.output.flush()
+            if self.fsync != 'off':
+                os.fsync(self.output.fileno())
+                self.syncs += 1
+        self.buffer = []
+        self.flushed = time.time()
+
+    def launched(self, server, workflow_id, execution_id, digest):
+        self._record({'event': 'launched', 'server': server,
+                      'workflow_id': workflow_id, 'execution_id': execution_id,
+                      'inputs': digest})
+
+    def finished(self, execution_id, workflow_state):
+        self._record({'event': 'finished', 'execution_id': execution_id,
+                      'state': workflow_state})
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.output.close()
+
+    def pending(self, servers=None):
+        """
+        Launch records of the executions without an end state, in launch
+        order, and the number that finished, optionally only those launched
+        on one of servers.  A line cut short by a crash is ignored.
+        """
+        self.flush()
+        launched = {}
+        finished = set()
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('event') == 'launched':
+                    if servers is None or record.get('server') in servers:
+                        launched[record['execution_id']] = record
+                elif record.get('event') == 'finished':
+                    finished.add(record.get('execution_id'))
+
+        pending = sorted((x for x in launched.values() if x['execution_id'] not in finished),
+                         key=lambda x: x['time'])
+        return pending, len(launched) - len(pending)
+
+    def stats(self):
+        return {'file': self.path, 'records': self.records, 'syncs': self.syncs}
+
+
+class WorkflowCatalogue(object):
+    """
+    Local index of the workflows on a vRO appliance: name, id, category and
+    input-parameter signature, built from one paged walk of the listing
+    """
+
+    def __init__(self, workflows, created=None):
+        self.workflows = workflows
+        self.created = created or time.time()
+        self.by_name = {}
+        self.by_id = {}
+        for workflow in workflows:
+            self.by_name.setdefault(workflow['name'], []).append(workflow)
+            self.by_id[workflow['id']] = workflow
+
+    @classmethod
+    def load(cls, path, server, port, ttl):
+        try:
+            with open(os.path.expanduser(path)) as catalogue_file:
+                data = json.load(catalogue_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('server') != server or str(data.get('port')) != str(port):
+            return None
+        if time.time() - data.get('created', 0) >= ttl:
+            return None
+        return cls(data.get('workflows', []), data['created'])
+
+    def save(self, path, server, port):
+        path = os.path.expanduser(path)
+        catalogue_dir = os.path.dirname(path) or '.'
+        if not os.path.isdir(catalogue_dir):
+            os.makedirs(catalogue_dir)
+        fd, tmp_path = tempfile.mkstemp(dir=catalogue_dir)
+        with os.fdopen(fd, 'w') as catalogue_file:
+            json.dump({'server': server, 'port': port, 'created': self.created,
+                       'workflows': self.workflows}, catalogue_file)
+        os.rename(tmp_path, path)
+        return os.path.getsize(path)
+
+    def lookup(self, name):
+        return self.by_name.get(name, [])
+
+    def signature(self, workflow_id):
+        workflow = self.by_id.get(workflow_id)
+        if workflow is None:
+            return None
+        return workflow.get('inputs')
+
+
+class VROMetrics(object):
+    """
+    Timing, status and size of every vRO API call, aggregated per endpoint and
+    optionally traced one JSON object per line to a file
+    """
+
+    PHASES = ('dns', 'connect', 'tls', 'first_byte', 'total')
+
+    def __init__(self, trace_file=None):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.trace = open(os.path.expanduser(trace_file), 'a') if trace_file else None
+        self.exporter = None
+
+    @staticmethod
+    def endpoint(method, path):
+        parts = path.split('?')[0].split('/')
+        for i in range(1, len(parts)):
+            if parts[i] and parts[i - 1] in ('workflows', 'executions'):
+                parts[i] = '{id}'
+        return "{} {}".format(method, '/'.join(parts))
+
+    def record(self, method, path, status, size, timings):
+        endpoint = self.endpoint(method, path)
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {'calls': 0, 'bytes': 0,
+                                                         'max': 0.0, 'status': {}})
+            entry['calls'] += 1
+            entry['bytes'] += size
+            entry['max'] = max(entry['max'], timings['total'])
+            entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+            for phase in self.PHASES:
+                if phase in timings:
+                    entry[phase] = entry.get(phase, 0.0) + timings[phase]
+
+            if self.exporter:
+                self.exporter.api_call(endpoint, status, timings['total'])
+
+            if self.trace:
+                trace = {'time': round(time.time(), 6), 'endpoint': endpoint,
+                         'path': path, 'status': status, 'size': size}
+                trace.update((k, round(v, 6)) for k, v in timings.items())
+                self.trace.write(json.dumps(trace) + "\n")
+                self.trace.flush()
+
+    def summary(self):
+        summary = {}
+        with self.lock:
+            for endpoint, entry in self.endpoints.items():
+                summary[endpoint] = {'calls': entry['calls'],
+                                     'bytes': entry['bytes'],
+                                     'status': dict(entry['status']),
+                                     'max': round(entry['max'], 6),
+                                     'mean': round(entry['total'] / entry['calls'], 6)}
+                for phase in self.PHASES:
+                    if phase in entry:
+                        summary[endpoint][phase] = round(entry[phase], 6)
+        return summary
+
+
+class VROProfile(object):
+    """
+    Wall time spent in the phases of a run, added up across threads, so
+    nested phases overlap: http is part of wait.  With a profile_dir the
+    stacks of all threads are sampled every SAMPLE_INTERVAL seconds and
+    written there in the folded format read by flamegraph.pl and
+    speedscope.  With cprofile the run is also profiled by cProfile, its
+    stats written to profile_dir.
+    """
+
+    SAMPLE_INTERVAL = 0.005
+    TOP = 10
+
+    def __init__(self, profile_dir=None, cprofile=False, name='vro'):
+        self.lock = threading.Lock()
+        self.started = timer()
+        self.phases = {}
+        self.profile_dir = os.path.expanduser(profile_dir) if profile_dir else None
+        self.name = "{}-{}-{}".format(re.sub(r'[^\w.-]', '_', name),
+                                      time.strftime('%Y%m%dT%H%M%S'), os.getpid())
+        self.summarised = None
+        self.stacks = {}
+        self.names = {}
+        self.samples = 0
+        self.sampling = None
+        if self.profile_dir:
+            self.sampling = threading.Event()
+            self.sampler = threading.Thread(target=self.sample)
+            self.sampler.daemon = True
+            self.sampler.start()
+        self.cprofile = None
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def add(self, phase, seconds):
+        with self.lock:
+            entry = self.phases.setdefault(phase, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def frame_name(self, frame):
+        code = frame.f_code
+        if code not in self.names:
+            self.names[code] = "{}:{}".format(
+                os.path.splitext(os.path.basename(code.co_filename))[0], code.co_name)
+        return self.names[code]
+
+    def sample(self):
+        own = threading.current_thread().ident
+        while not self.sampling.wait(self.SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_name(frame))
+                    frame = frame.f_back
+                stack = ';'.join(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def _path(self, suffix):
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        return os.path.join(self.profile_dir, self.name + suffix)
+
+    def top_functions(self):
+        import pstats
+
+        stats = pstats.Stats(self.cprofile).stats
+        top = sorted(stats.items(), key=lambda x: x[1][2], reverse=True)[:self.TOP]
+        return [{'function': "{}:{}({})".format(os.path.basename(key[0]), key[1], key[2]),
+                 'calls': value[1],
+                 'self_seconds': round(value[2], 6),
+                 'cumulative_seconds': round(value[3], 6)} for key, value in top]
+
+    def summary(self):
+        """
+        The slowest phases, and slowest functions with cprofile, of the run
+        so far.  The first call stops sampling and cProfile and writes the
+        files in profile_dir, later calls return the same summary.
+        """
+        if self.summarised is not None:
+            return self.summarised
+
+        if self.cprofile:
+            self.cprofile.disable()
+        if self.sampling:
+            self.sampling.set()
+            self.sampler.join()
+
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda x: x[1][1], reverse=True)
+        summary = {'seconds': round(timer() - self.started, 6),
+                   'phases': [{'phase': phase, 'calls': calls, 'seconds': round(seconds, 6)}
+                              for phase, (calls, seconds) in phases[:self.TOP]]}
+        if self.cprofile:
+            summary['top_functions'] = self.top_functions()
+
+        # failing to write the files never fails the run that was profiled
+        if self.profile_dir:
+            summary['samples'] = self.samples
+            try:
+                stack_path = self._path('.folded')
+                with open(stack_path, 'w') as stack_file:
+                    for stack, count in sorted(self.stacks.items()):
+                        stack_file.write("{} {}\n".format(stack, count))
+                summary['stack_file'] = stack_path
+                if self.cprofile:
+                    cprofile_path = self._path('.pstats')
+                    self.cprofile.dump_stats(cprofile_path)
+                    summary['cprofile_file'] = cprofile_path
+            except (IOError, OSError) as err:
+                summary['error'] = "Unable to write profile: {}".format(err)
+
+        self.summarised = summary
+        return summary
+
+
+class VROExporter(object):
+    """
+    Prometheus metrics of the executions launched and waited on and of the
+    vRO API calls made, rendered in the text exposition format.  They can be
+    served over HTTP by a long running process, or merged into a file read by
+    the node_exporter textfile collector: counters and histograms add to those
+    already in the file, so they keep growing across short lived tasks.
+    """
+
+    FAMILIES = (
+        ('vro_executions_launched_total', 'counter', 'Executions launched'),
+        ('vro_executions_finished_total', 'counter',
+         'Executions seen finished or timed out, by state'),
+        ('vro_executions_in_flight', 'gauge',
+         'Executions launched or waited on and not yet seen finished'),
+        ('vro_execution_duration_seconds', 'histogram',
+         'Seconds from launch, or from the first wait, until the execution '
+         'was seen finished'),
+        ('vro_api_requests_total', 'counter', 'vRO API calls, by endpoint and status'),
+        ('vro_api_request_duration_seconds', 'histogram', 'Seconds per vRO API call'),
+    )
+    BUCKETS = {'vro_execution_duration_seconds': (1, 5, 10, 30, 60, 120, 300, 600,
+                                                  1800, 3600),
+               'vro_api_request_duration_seconds': (0.005, 0.01, 0.025, 0.05, 0.1,
+                                                    0.25, 0.5, 1, 2.5, 5, 10)}
+    SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+    LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = dict((x[0], {}) for x in self.FAMILIES)
+        self.in_flight = {}
+
+    @staticmethod
+    def labels(**labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _add(self, name, labels, value=1):
+        series = self.samples[name]
+        series[labels] = series.get(labels, 0) + value
+
+    def _observe(self, name, labels, value):
+        series = self.samples[name]
+        buckets = self.BUCKETS[name]
+        if labels not in series:
+            series[labels] = [0] * len(buckets) + [0, 0.0]
+        counts = series[labels]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += value
+
+    def launched(self, workflow_id, execution_id):
+        with self.lock:
+            self._add('vro_executions_launched_total', self.labels(workflow_id=workflow_id))
+            self.in_flight[execution_id] = (workflow_id, time.time())
+
+    def watching(self, workflow_id, execution_id):
+        """
+        Track an execution launched elsewhere, its duration counted from now
+        """
+        with self.lock:
+            self.in_flight.setdefault(execution_id, (workflow_id, time.time()))
+
+    def finished(self, workflow_id, execution_id, workflow_state):
+        with self.lock:
+            self._add('vro_executions_finished_total',
+                      self.labels(workflow_id=workflow_id, state=workflow_state))
+            if workflow_state == 'timeout':
+                return
+            workflow_id, started = self.in_flight.pop(execution_id, (workflow_id, None))
+            if started is not None:
+                self._observe('vro_execution_duration_seconds',
+                              self.labels(workflow_id=workflow_id), time.time() - started)
+
+    def forget(self, execution_id):
+        with self.lock:
+            self.in_flight.pop(execution_id, None)
+
+    def api_call(self, endpoint, status, seconds):
+        with self.lock:
+            self._add('vro_api_requests_total', self.labels(endpoint=endpoint, status=status))
+            self._observe('vro_api_request_duration_seconds',
+                          self.labels(endpoint=endpoint), seconds)
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format
+        """
+        with self.lock:
+            in_flight = {}
+            for workflow_id, started in self.in_flight.values():
+                key = self.labels(workflow_id=workflow_id)
+                in_flight[key] = in_flight.get(key, 0) + 1
+            self.samples['vro_executions_in_flight'] = in_flight
+
+            lines = []
+            for name, kind, description in self.FAMILIES:
+                lines.append("# HELP {} {}.".format(name, description))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for labels, value in sorted(self.samples[name].items()):
+                    if kind != 'histogram':
+                        lines.append(self._sample(name, labels, value))
+                        continue
+                    for bound, count in zip(self.BUCKETS[name] + ('+Inf',), value):
+                        lines.append(self._sample(name + '_bucket',
+                                                  labels + (('le', str(bound)),),
+                                                  count if bound != '+Inf' else value[-2]))
+                    lines.append(self._sample(name + '_sum', labels, round(value[-1], 6)))
+                    lines.append(self._sample(name + '_count', labels, value[-2]))
+            return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _sample(name, labels, value):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        if not labels:
+            return "{} {}".format(name, value)
+        return "{}{{{}}} {}".format(name, ','.join(
+            '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in labels), value)
+
+    def merge_text(self, text):
+        """
+        Add the counters and histograms of a previous render() to these
+        """
+        kinds = dict((x[0], x[1]) for x in self.FAMILIES)
+        with self.lock:
+            for line in text.splitlines():
+                match = self.SAMPLE.match(line)
+                if not match:
+                    continue
+                name, labels, value = match.groups()
+                labels = tuple(sorted((k, v.replace('\\"', '"').replace('\\\\', '\\'))
+                                      for k, v in self.LABEL.findall(labels or '')))
+                try:
+                    value = float(value)
+                except ValueError:
+                    continue
+                if kinds.get(name) == 'counter':
+                    self._add(name, labels, value)
+                    continue
+                base, dummy, suffix = name.rpartition('_')
+                if kinds.get(base) != 'histogram':
+                    continue
+                buckets = self.BUCKETS[base]
+                series_labels = tuple(x for x in labels if x[0] != 'le')
+                series = self.samples[base]
+                counts = series.setdefault(series_labels, [0] * len(buckets) + [0, 0.0])
+                if suffix == 'sum':
+                    counts[-1] += value
+                elif suffix == 'count':
+                    counts[-2] += int(value)
+                elif suffix == 'bucket':
+                    bound = dict(labels).get('le')
+                    bounds = [str(x) for x in buckets]
+                    if bound in bounds:
+                        counts[bounds.index(bound)] += int(value)
+
+    def write_textfile(self, path):
+        """
+        Merge the metrics into a textfile collector file, holding a lock on
+        it so that concurrent tasks do not lose each other's counts
+        """
+        path = os.path.expanduser(path)
+        text_dir = os.path.dirname(path) or '.'
+        if not os.path.isdir(text_dir):
+            os.makedirs(text_dir)
+        with open(path + '.lock', 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(path) as text_file:
+                    self.merge_text(text_file.read())
+            except (IOError, OSError):
+                pass
+            fd, tmp_path = tempfile.mkstemp(dir=text_dir)
+            with os.fdopen(fd, 'w') as text_file:
+                text_file.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+
+    def serve(self, address='127.0.0.1', port=9470):
+        """
+        Serve the metrics on http://address:port/metrics from a background
+        thread, returning the server
+        """
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer((address, port), MetricsHandler)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        return server
+
+
+class VROConnectionPool(object):
+    """
+    Keep-alive HTTPS connections to a vRO appliance, shared by all threads
+    """
+
+    def __init__(self, server, port, validate_certs, size=8, idle_timeout=15,
+                 timeout=10, metrics=None):
+        self.server = server
+        self.port = int(port)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.context = ssl.create_default_context()
+        if not validate_certs:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.slots = threading.Semaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self.metrics = metrics
+
+    def _open(self, conn):
+        """
+        Open the connection's socket ourselves so that name lookup, TCP
+        connect and TLS handshake can be timed separately, and so that
+        Nagle's algorithm can be disabled: http_client sends a POST body
+        separately from its headers, which otherwise stalls every launch
+        on the server's delayed ACK
+        """
+        timings = {}
+        start = time.time()
+        family, socktype, proto, canonname, address = socket.getaddrinfo(
+            self.server, self.port, 0, socket.SOCK_STREAM)[0]
+        timings['dns'] = time.time() - start
+
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.connect(address)
+            timings['connect'] = time.time() - start - timings['dns']
+            conn.sock = self.context.wrap_socket(sock, server_hostname=self.server)
+        except (socket.error, ssl.CertificateError):
+            sock.close()
+            raise
+        timings['tls'] = time.time() - start - timings['dns'] - timings['connect']
+
+        return timings
+
+    def _connect(self):
+        with self.lock:
+            self.connections_opened += 1
+        return http_client.HTTPSConnection(self.server, self.port,
+                                           timeout=self.timeout,
+                                           context=self.context)
+
+    @staticmethod
+    def dropped(conn):
+        """
+        Whether the server has closed an idle connection: nothing is due on
+        it, so a socket that is readable has reached EOF or holds a TLS
+        close_notify
+        """
+        if conn.sock is None:
+            return True
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (socket.error, ValueError):
+            return True
+
+    def _checkout(self):
+        now = time.time()
+        with self.lock:
+            while self.idle:
+                conn, last_used = self.idle.pop()
+                if now - last_used < self.idle_timeout and not self.dropped(conn):
+                    return conn, True
+                conn.close()
+        return self._connect(), False
+
+    def _checkin(self, conn):
+        with self.lock:
+            self.idle.append((conn, time.time()))
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send a request and return the response with its body already read.
+        A GET on a reused connection that the server has since closed is
+        retried once on a new connection.  Connection errors carry
+        request_sent, false when they happened before any of the request
+        was written.
+        """
+        self.slots.acquire()
+        try:
+            conn, reused = self._checkout()
+            while True:
+                with self.lock:
+                    self.requests_sent += 1
+                sent = False
+                try:
+                    timings = {}
+                    start = time.time()
+                    if not reused:
+                        timings = self._open(conn)
+                    sent = True
+                    conn.request(method, path, body, headers or {})
+                    resp = conn.getresponse()
+                    timings['first_byte'] = time.time() - start
+                    raw_data = resp.read()
+                    timings['total'] = time.time() - start
+                except (http_client.HTTPException, socket.error) as err:
+                    conn.close()
+                    if reused and method == 'GET':
+                        conn, reused = self._connect(), False
+                        continue
+                    err.request_sent = sent
+                    raise
+                break
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+
+            if self.metrics is not None:
+                self.metrics.record(method, path, resp.status, len(raw_data), timings)
+
+            return resp, raw_data
+        finally:
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            for conn, last_used in self.idle:
+                conn.close()
+            self.idle = []
+
+    def stats(self):
+        return {'connections_opened': self.connections_opened,
+                'requests_sent': self.requests_sent}
+
+
+def parse_endpoint(endpoint, default_port):
+    """
+    Server and port of an endpoint given as host or host:port
+    """
+    server, sep, port = str(endpoint).rpartition(':')
+    if sep and port.isdigit() and server:
+        return server.strip('[]'), int(port)
+    return str(endpoint), int(default_port)
+
+
+class VRONode(object):
+    """
+    One vRO node of a cluster: its connection pool, the executions launched
+    on it that are still running and when it may next be tried after failing
+    """
+
+    def __init__(self, server, port, pool):
+        self.server = server
+        self.port = port
+        self.pool = pool
+        self.running = set()
+        self.launched = 0
+        self.failures = 0
+        self.down_until = 0
+
+    @property
+    def name(self):
+        return "{}:{}".format(self.server, self.port)
+
+
+class EndpointSet(object):
+    """
+    The vRO nodes a client talks to.  New executions go to the healthy node
+    with the fewest executions running, or to each node in turn, and every
+    later request about an execution goes to the node that launched it.
+    Other requests go to the first healthy node.  A node that cannot be
+    reached, or turns requests away, is skipped for down_interval seconds
+    and then probed with a GET of the about endpoint before it is used again.
+    """
+
+    EXECUTION = re.compile(r'executions/([^/?]+)')
+    LAUNCH = re.compile(r'^workflows/[^/?]+/executions/?$')
+
+    def __init__(self, nodes, strategy='least_in_flight', down_interval=30):
+        self.nodes = nodes
+        self.strategy = strategy
+        self.down_interval = down_interval
+        self.lock = threading.Lock()
+        self.owners = {}
+        self.turn = 0
+        self.failovers = 0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @classmethod
+    def launch(cls, method, path):
+        return method == 'POST' and cls.LAUNCH.match(path) is not None
+
+    def available(self, node, probe):
+        """
+        Whether node may be used, probing it when it has been down for
+        down_interval.  Only one caller probes, as the probe pushes the
+        node's down_until forward first.
+        """
+        with self.lock:
+            if not node.down_until:
+                return True
+            if time.time() < node.down_until:
+                return False
+            node.down_until = time.time() + self.down_interval
+        if not probe(node):
+            return False
+        with self.lock:
+            node.down_until = 0
+        return True
+
+    def route(self, method, path, tried, probe):
+        """
+        Node the request should be sent to next, or None once every node
+        has been tried
+        """
+        candidates = [x for x in self.nodes if x not in tried]
+        if not candidates:
+            return None
+
+        match = self.EXECUTION.search(path)
+        owner = self.owners.get(match.group(1)) if match else None
+        if owner in candidates and self.available(owner, probe):
+            return owner
+
+        healthy = [x for x in candidates if self.available(x, probe)] or candidates
+        if not self.launch(method, path) or len(healthy) == 1:
+            return healthy[0]
+
+        with self.lock:
+            if self.strategy == 'round_robin':
+                # turn only moves on launches that succeeded, see launched()
+                start = self.turn % len(self.nodes)
+                ordered = self.nodes[start:] + self.nodes[:start]
+                return [x for x in ordered if x in healthy][0]
+            return min(healthy, key=lambda x: (len(x.running), x.launched))
+
+    def mark_down(self, node, tried):
+        """
+        Skip node for down_interval, returning whether another node is left
+        to send the request to
+        """
+        if len(self.nodes) == 1:
+            return False
+        with self.lock:
+            node.failures += 1
+            node.down_until = time.time() + self.down_interval
+            spare = len(tried) < len(self.nodes)
+            if spare:
+                self.failovers += 1
+            return spare
+
+    def launched(self, node, execution_id):
+        with self.lock:
+            self.turn = self.nodes.index(node) + 1
+            node.launched += 1
+            node.running.add(execution_id)
+            self.owners[execution_id] = node
+
+    def adopt(self, execution_id, name):
+        """
+        Route the requests about an execution launched by an earlier task
+        to the node named
+        """
+        with self.lock:
+            for node in self.nodes:
+                if node.name == name:
+                    node.running.add(execution_id)
+                    self.owners[execution_id] = node
+
+    def finished(self, execution_id):
+        with self.lock:
+            node = self.owners.get(execution_id)
+            if node is not None:
+                node.running.discard(execution_id)
+
+    def connection_stats(self):
+        stats = {}
+        for node in self.nodes:
+            for key, value in node.pool.stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {'failovers': self.failovers,
+                    'strategy': self.strategy,
+                    'nodes': dict((x.name, {'launched': x.launched,
+                                            'running': len(x.running),
+                                            'failures': x.failures,
+                                            'healthy': x.down_until <= now})
+                                  for x in self.nodes)}
+
+
+class VROClient(object):
+    """
+    vRO REST API client.  Failures raise VROError, so the client can be used
+    outside Ansible; options are named after the module's options.
+    """
+
+    BASE_URL = "https://{}:{}{}"
+    API_PATH = "/vco/api/{}"
+    TERMINAL_STATES = ('failed', 'completed', 'canceled')
+    # connection options a vro_agent.py agent polls with on behalf of a task
+    AGENT_OPTIONS = ('validate_certs', 'endpoints', 'endpoint_strategy',
+                     'endpoint_down_interval', 'pool_size', 'pool_idle_timeout',
+                     'poll_concurrency', 'rate_limit', 'rate_limit_burst', 'retries',
+                     'retry_interval', 'retry_max_interval')
+    HISTORY_RUNS = 100
+    LISTING_RUNS = 500
+    WAIT_STRATEGIES = ('state', 'listing')
+
+    DEFAULTS = dict(validate_certs=True,
+                    endpoints=None,
+                    agent_socket=None,
+                    journal_file=None,
+                    journal_fsync='batch',
+                    journal_fsync_interval=1.0,
+                    endpoint_strategy='least_in_flight',
+                    endpoint_down_interval=30,
+                    input_validation='catalogue',
+                    required_inputs=None,
+                    poll_concurrency=8,
+                    poll_initial_interval=0.25,
+                    poll_max_interval=5.0,
+                    poll_backoff=1.5,
+                    poll_jitter=0.1,
+                    poll_seed_from_history=False,
+                    wait_strategy='state',
+                    log_file=None,
+                    log_interval=10.0,
+                    log_page_size=100,
+                    result_fields=None,
+                    result_flatten=False,
+                    result_inputs=True,
+                    result_relations=False,
+                    idempotency='off',
+                    idempotency_file=None,
+                    idempotency_ttl=3600,
+                    idempotency_history=20,
+                    timeout_from_history=False,
+                    cache_file=None,
+                    cache_ttl=86400,
+                    cache_invalidate=False,
+                    catalogue_file=None,
+                    pool_size=8,
+                    pool_idle_timeout=15,
+                    metrics=False,
+                    metrics_trace_file=None,
+                    prometheus_textfile=None,
+                    profile=False,
+                    profile_dir=None,
+                    profile_cprofile=False,
+                    rate_limit=0,
+                    rate_limit_burst=None,
+                    max_in_flight=0,
+                    max_in_flight_timeout=600,
+                    retries=3,
+                    retry_interval=0.5,
+                    retry_max_interval=30.0)
+
+    def __init__(self, server, port, username, password, **options):
+        unknown = set(options) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError("Unknown VROClient options: {}".format(', '.join(sorted(unknown))))
+        params = dict(self.DEFAULTS)
+        params.update(options)
+
+        self.user = username
+        self.pwd = password
+        self.server = server
+        self.port = port
+        credentials = "{}:{}".format(self.user, self.pwd).encode('utf-8')
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json',
+                        'Authorization': 'Basic {}'.format(
+                            base64.b64encode(credentials).decode('ascii'))}
+        self.validate_certs = params['validate_certs']
+        self.poll_concurrency = params['poll_concurrency']
+        self.poll_initial_interval = params['poll_initial_interval']
+        self.poll_max_interval = params['poll_max_interval']
+        self.poll_backoff = params['poll_backoff']
+        self.poll_jitter = params['poll_jitter']
+        self.poll_seed_from_history = params['poll_seed_from_history']
+        if params['wait_strategy'] not in self.WAIT_STRATEGIES:
+            raise ValueError("Unknown wait_strategy: {}".format(params['wait_strategy']))
+        self.wait_strategy = params['wait_strategy']
+        self.requests_saved = 0
+        self.result_projection = dict(fields=params['result_fields'],
+                                      flatten=params['result_flatten'],
+                                      inputs=params['result_inputs'],
+                                      relations=params['result_relations'])
+        self.results = 0
+        self.result_bytes_fetched = 0
+        self.result_bytes_kept = 0
+        self.idempotency = params['idempotency']
+        self.idempotency_ttl = params['idempotency_ttl']
+        self.idempotency_history = params['idempotency_history']
+        self.run_cache = WorkflowIdCache(params['idempotency_file'],
+                                         params['idempotency_ttl'])
+        self.reused = 0
+        self.history_checked = 0
+        self.log_tail = None
+        if params['log_file']:
+            self.log_tail = ExecutionLogTail(params['log_file'],
+                                             params['log_interval'],
+                                             params['log_page_size'])
+        self.scheduler_class = PollScheduler
+        self.timeout_from_history = params['timeout_from_history']
+        self.statistics = {}
+        self.cache = WorkflowIdCache(params['cache_file'],
+                                     params['cache_ttl'])
+        self.cache_invalidate = params['cache_invalidate']
+        self.catalogue = None
+        self.catalogue_hits = 0
+        self.input_validation = params['input_validation']
+        self.required_inputs = params['required_inputs'] or []
+        self.signature_cache = WorkflowIdCache(params['cache_file'],
+                                               params['cache_ttl'])
+        self.compiled = {}
+        if params['catalogue_file']:
+            self.catalogue = WorkflowCatalogue.load(params['catalogue_file'],
+                                                    self.server, self.port,
+                                                    params['cache_ttl'])
+        self.resolved = set()
+        self.polls = 0
+        self.wasted_wait = 0.0
+        self.profiler = None
+        if params['profile'] or params['profile_dir'] or params['profile_cprofile']:
+            self.profiler = VROProfile(params['profile_dir'], params['profile_cprofile'],
+                                       self.server)
+        self.metrics = None
+        self.report_metrics = params['metrics']
+        if params['metrics'] or params['metrics_trace_file']:
+            self.metrics = VROMetrics(params['metrics_trace_file'])
+        nodes = []
+        for server, port in [(self.server, self.port)] + \
+                [parse_endpoint(x, self.port) for x in params['endpoints'] or []]:
+            pool = VROConnectionPool(server, port, self.validate_certs,
+                                     size=params['pool_size'],
+                                     idle_timeout=params['pool_idle_timeout'],
+                                     metrics=self.metrics)
+            nodes.append(VRONode(server, port, pool))
+        self.endpoints = EndpointSet(nodes, params['endpoint_strategy'],
+                                     params['endpoint_down_interval'])
+        self.exporter = None
+        self.prometheus_textfile = params['prometheus_textfile']
+        self.textfile_written = False
+        if self.prometheus_textfile:
+            self.export(VROExporter())
+            atexit.register(self.write_textfile)
+        self.agent_socket = params['agent_socket']
+        self.agent_options = dict((x, params[x]) for x in self.AGENT_OPTIONS)
+        self.agent_waits = 0
+        self.agent_fallbacks = 0
+        self.journal = None
+        if params['journal_file']:
+            self.journal = ExecutionJournal(params['journal_file'],
+                                            params['journal_fsync'],
+                                            params['journal_fsync_interval'])
+        self.rate_limiter = None
+        if params['rate_limit']:
+            self.rate_limiter = TokenBucket(params['rate_limit'],
+                                            params['rate_limit_burst'])
+        self.retry_policy = RetryPolicy(params['retries'],
+                                        params['retry_interval'],
+                                        params['retry_max_interval'])
+        self.max_in_flight = params['max_in_flight']
+        self.max_in_flight_timeout = params['max_in_flight_timeout']
+        self.in_flight = {}
+        self.seen_finished = {}
+        self.governor_lock = threading.Lock()
+        self.throttled = 0
+        self.throttle_wait = 0.0
+        self.retried = 0
+        self.launches_held = 0
+
+    def _api_path(self, path):
+        return self.API_PATH.format(path)
+
+    def _api_url(self, path, node=None):
+        node = node or self.endpoints.nodes[0]
+        return self.BASE_URL.format(node.server, node.port, self._api_path(path))
+
+    def _fail(self, msg, status=None):
+        fail(msg, status)
+
+    def _throttle(self):
+        if self.rate_limiter is None:
+            return
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            with self.governor_lock:
+                self.throttled += 1
+                self.throttle_wait += delay
+            time.sleep(delay)
+
+    def _retry_wait(self, attempt, retry_after=None):
+        with self.governor_lock:
+            self.retried += 1
+        time.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    def _probe(self, node):
+        """
+        Health check of a node that was down: any answer but a 5xx will do
+        """
+        try:
+            resp, raw_data = node.pool.request('GET', self._api_path('about'),
+                                               None, self.headers)
+        except (http_client.HTTPException, socket.error):
+            return False
+        return resp.status < 500
+
+    def _request(self, node, method, path, data):
+        started = timer()
+        try:
+            return node.pool.request(method, self._api_path(path), data, self.headers)
+        finally:
+            if self.profiler:
+                self.profiler.add('http', timer() - started)
+
+    def _send(self, node, method, path, data, tried):
+        """
+        Send a request to one node, retried as the retry policy allows.
+        Returns None when the node could not be reached or turned the request
+        away and another node is left to send it to.
+        """
+        attempt = 0
+        while True:
+            self._throttle()
+            try:
+                resp, raw_data = self._request(node, method, path, data)
+            except (ssl.SSLError, ssl.CertificateError) as err:
+                self._fail("Error validating the server's certificate: %s" % (str(err)))
+            except (http_client.HTTPException, socket.error) as err:
+                # a launch that may have reached the node is not sent elsewhere
+                if (method == 'GET' or not getattr(err, 'request_sent', True)) and \
+                        self.endpoints.mark_down(node, tried):
+                    return None
+                if isinstance(err, socket.gaierror):
+                    self._fail("Failed lookup url: %s" % (str(err)))
+                if not self.retry_policy.retry_error(attempt, method, err):
+                    self._fail("Error connecting: %s" % (str(err)))
+                self._retry_wait(attempt)
+                attempt += 1
+                continue
+
+            if resp.status in RetryPolicy.RETRY_STATUS and \
+                    self.endpoints.mark_down(node, tried):
+                return None
+            if not self.retry_policy.retry_status(attempt, resp.status):
+                return resp, raw_data
+            self._retry_wait(attempt, resp.getheader('retry-after'))
+            attempt += 1
+
+    def _do_send(self, method, path, data=None):
+
+        resp = None
+        if data is None and method == 'POST':
+            data = "{}"
+
+        tried = []
+        while True:
+            node = self.endpoints.route(method, path, tried, self._probe)
+            tried.append(node)
+            resp, raw_data = self._send(node, method, path, data, tried) or (None, None)
+            if resp is not None:
+                break
+
+        url = self._api_url(path, node)
+
+        if self.endpoints.launch(method, path) and resp.status == 202:
+            self.endpoints.launched(node, execution_id_from_location(
+                resp.getheader('location')))
+
+        if resp.status >= 400:
+            self._fail("Received HTTP error: HTTP Error %s: %s" % (resp.status, resp.reason),
+                       resp.status)
+
+        status_code = resp.status
+        status_url = url
+        status_info = resp.msg
+
+        try:
+            if raw_data:
+                started = timer()
+                data = json.loads(raw_data)
+                if self.profiler:
+                    self.profiler.add('json_decode', timer() - started)
+            else:
+                data = None
+        except (TypeError, ValueError):
+            fail_msg = "Unable to convert to JSON"
+            self._fail(fail_msg)
+
+        return status_code, status_url, status_info, data
+
+    def stats(self):
+        cache_stats = self.cache.stats()
+        cache_stats['catalogue_hits'] = self.catalogue_hits
+        cache_stats['signatures_fetched'] = self.signature_cache.misses
+        stats = {'cache_stats': cache_stats,
+                 'connection_stats': self.endpoints.connection_stats(),
+                 'poll_stats': {'polls': self.polls,
+                                'wasted_wait': round(self.wasted_wait, 3),
+                                'strategy': self.wait_strategy,
+                                'requests_saved': self.requests_saved},
+                 'governor_stats': {'throttled': self.throttled,
+                                    'throttle_wait': round(self.throttle_wait, 3),
+                                    'retried': self.retried,
+                                    'launches_held': self.launches_held},
+                 'result_stats': {'results': self.results,
+                                  'bytes_fetched': self.result_bytes_fetched,
+                                  'bytes_kept': self.result_bytes_kept}}
+        if self.report_metrics:
+            stats['metrics'] = self.metrics.summary()
+        if self.log_tail:
+            stats['log_stats'] = self.log_tail.stats()
+        if len(self.endpoints) > 1:
+            stats['endpoint_stats'] = self.endpoints.stats()
+        if self.journal:
+            stats['journal_stats'] = self.journal.stats()
+        if self.agent_socket:
+            stats['agent_stats'] = {'waits': self.agent_waits,
+                                    'fallbacks': self.agent_fallbacks}
+        if self.idempotency != 'off':
+            stats['idempotency_stats'] = {'reused': self.reused,
+                                          'cache_hits': self.run_cache.hits,
+                                          'history_checked': self.history_checked}
+        if self.profiler:
+            stats['profile_stats'] = self.profiler.summary()
+        return stats
+
+    def write_textfile(self):
+        """
+        Merge the metrics into prometheus_textfile, once, returning why they
+        could not be written or None.  The module writes them with its
+        result, other users when the process exits.
+        """
+        if not self.prometheus_textfile or self.textfile_written:
+            return None
+        self.textfile_written = True
+        try:
+            self.exporter.write_textfile(self.prometheus_textfile)
+        except (IOError, OSError) as err:
+            return "Unable to write {}: {}".format(self.prometheus_textfile, err)
+        return None
+
+    def module_result(self, **kwargs):
+        result = self.stats()
+        textfile_error = self.write_textfile()
+        if textfile_error:
+            result['prometheus_textfile_error'] = textfile_error
+        result.update(kwargs)
+        return result
+
+    def _do_get(self, path, data=None):
+        return self._do_send('GET', path, data)
+
+    def _do_post(self, path, data=None):
+        return self._do_send('POST', path, data)
+
+    def workflow_id(self, wf_name, refresh=False):
+
+        cache_key = self.cache.key(self.server, self.port, wf_name)
+        if not (refresh or self.cache_invalidate):
+            if self.catalogue and len(self.catalogue.lookup(wf_name)) == 1:
+                self.catalogue_hits += 1
+                return self.catalogue.lookup(wf_name)[0]['id']
+            wf_href = self.cache.get(cache_key)
+            if wf_href:
+                return wf_href
+
+        path = 'workflows?conditions=name={}'.format(wf_name)
+
+        status_code, status_url, status_info, data = self._do_get(path)
+
+        wf_href = workflow_id_from_listing(wf_name, data)
+
+        self.cache.set(cache_key, wf_href)
+        self.resolved.add(wf_name)
+
+        return wf_href
+
+    def named_workflow(self, wf_name, func, workflow_id=None):
+        """
+        Call func with the UUID of the named workflow, or the workflow_id it
+        was already resolved to, returning the UUID and the result of func
+        """
+        workflow_id = workflow_id or self.workflow_id(wf_name)
+
+        try:
+            result = func(workflow_id)
+        except VROError as err:
+            # a cached UUID may belong to a workflow that has been re-imported
+            if err.status != 404 or not wf_name or wf_name in self.resolved:
+                raise
+            self.cache.invalidate(self.cache.key(self.server, self.port, wf_name))
+            workflow_id = self.workflow_id(wf_name, refresh=True)
+            result = func(workflow_id)
+
+        return workflow_id, result
+
+    def run_workflow_named(self, wf_name, inputs):
+
+        return self.named_workflow(wf_name, lambda x: self.run_workflow(x, inputs))
+
+    def list_workflows(self, page_size=500):
+
+        start = 0
+        while True:
+            path = 'workflows?maxResult={}&startIndex={}'.format(page_size, start)
+
+            status_code, status_url, status_info, data = self._do_get(path)
+
+            links = (data or {}).get('link', [])
+            for link in links:
+                attrs = link_attributes(link)
+                yield {'id': attrs.get('id'),
+                       'name': attrs.get('name'),
+                       'category': attrs.get('categoryName')}
+
+            start += len(links)
+            if len(links) < page_size or start >= (data or {}).get('total', 0):
+                return
+
+    def workflow_signature(self, workflow_id):
+
+        path = "workflows/{}/".format(workflow_id)
+
+        status_code, status_url, status_info, data = self._do_get(path)
+
+        if status_code != 200:
+            self._fail("Failed to get workflow: {}".format(workflow_id), status_code)
+
+        return [{'name': x.get('name'), 'type': x.get('type')}
+                for x in (data or {}).get('input-parameters', [])]
+
+    def build_catalogue(self, page_size=500, signatures=True):
+
+        workflows = list(self.list_workflows(page_size))
+
+        if signatures:
+            inputs = self.map_concurrent(self.workflow_signature,
+                                         [x['id'] for x in workflows])
+            for workflow, signature in zip(workflows, inputs):
+                workflow['inputs'] = signature
+
+        return WorkflowCatalogue(workflows)
+
+    def input_signature(self, workflow_id, fetch=False):
+        """
+        Input parameter names and types of the workflow, from the catalogue
+        or, with input_validation=fetch or when fetch is set, from the
+        appliance through the cache_file.  None when not known.
+        """
+        if self.input_validation == 'off':
+            return None
+
+        signature = self.catalogue.signature(workflow_id) if self.catalogue else None
+        if signature is not None or not (fetch or self.input_validation == 'fetch'):
+            return signature
+
+        cache_key = self.signature_cache.key(self.server, self.port,
+                                             'signature:' + workflow_id)
+        signature = self.signature_cache.get(cache_key)
+        if signature is None:
+            signature = self.workflow_signature(workflow_id)
+            self.signature_cache.set(cache_key, signature)
+
+        return signature
+
+    def prepare_inputs(self, workflow_id, inputs):
+        """
+        Inputs of a launch of the workflow, compiled from the shorthand,
+        checked against its signature and for required_inputs, once per
+        distinct inputs
+        """
+        memo_key = (workflow_id, inputs_json(inputs))
+        if memo_key in self.compiled:
+            return self.compiled[memo_key]
+
+        shorthand = bool(inputs) and not isinstance(inputs.get('parameters'), list)
+        signature = self.input_signature(workflow_id, shorthand)
+        try:
+            compiled = compile_inputs(inputs, signature)
+        except VROError as err:
+            raise VROError("{} (workflow {})".format(err, workflow_id), err.status)
+
+        given = set(x.get('name') for x in (compiled or {}).get('parameters', []))
+        missing = [x for x in self.required_inputs if x not in given]
+        if missing:
+            self._fail("Missing required input parameters of workflow {}: {}"
+                       .format(workflow_id, ', '.join(missing)))
+
+        self.compiled[memo_key] = compiled
+        return compiled
+
+    def map_concurrent(self, func, items):
+
+        items = list(items)
+        results = [None] * len(items)
+        position = [0]
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            while not errors:
+                with lock:
+                    index = position[0]
+                    if index >= len(items):
+                        return
+                    position[0] += 1
+                try:
+                    results[index] = func(items[index])
+                except VROError as err:
+                    errors.append(err)
+
+        workers = []
+        for dummy in range(max(1, min(self.poll_concurrency, len(items)))):
+            worker_thread = threading.Thread(target=worker)
+            worker_thread.daemon = True
+            worker_thread.start()
+            workers.append(worker_thread)
+
+        for worker_thread in workers:
+            worker_thread.join()
+
+        if errors:
+            raise errors[0]
+
+        return results
+
+    def hold_launch(self):
+        """
+        Block while max_in_flight executions launched by this client are
+        still running, waiting on them until one has finished
+        """
+        if not self.max_in_flight or len(self.in_flight) < self.max_in_flight:
+            return
+
+        self.launches_held += 1
+        deadline = time.time() + self.max_in_flight_timeout
+        while len(self.in_flight) >= self.max_in_flight:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self._fail("Timed out waiting for one of {} executions in flight "
+                           "to finish".format(len(self.in_flight)))
+            self.wait_for_workflows([(v, k) for k, v in self.in_flight.items()],
+                                    remaining, until_any=True)
+
+    def run_workflow(self, workflow_id, inputs):
+
+        path = "workflows/{}/executions/".format(workflow_id)
+
+        inputs = self.prepare_inputs(workflow_id, inputs)
+        started = timer()
+        json_data = inputs_json(inputs)
+        if self.profiler:
+            self.profiler.add('json_encode', timer() - started)
+
+        self.hold_launch()
+
+        status_code, status_url, status_info, data = self._do_post(path, json_data)
+
+        if status_code != 202:
+            fail_msg = "POST failed with status code: {}".format(status_code)
+            self._fail(fail_msg)
+
+        execution_id = execution_id_from_location(status_info['location'])
+        if self.max_in_flight:
+            self.in_flight[execution_id] = workflow_id
+        if self.exporter:
+            self.exporter.launched(workflow_id, execution_id)
+        if self.journal:
+            self.journal.launched(self.endpoints.owners[execution_id].name,
+                                  workflow_id, execution_id,
+                                  inputs_digest(workflow_id, inputs))
+
+        return execution_id
+
+    def _finished(self, workflow_id, execution_id, workflow_state):
+        """
+        Note that an execution was seen in a terminal state, once
+        """
+        if execution_id in self.seen_finished:
+            return
+        self.seen_finished[execution_id] = workflow_state
+        self.in_flight.pop(execution_id, None)
+        self.endpoints.finished(execution_id)
+        if self.journal:
+            self.journal.finished(execution_id, workflow_state)
+        if self.exporter:
+            self.exporter.finished(workflow_id, execution_id, workflow_state)
+
+    def export(self, exporter):
+        """
+        Report launches, completions and API calls to a VROExporter
+        """
+        self.exporter = exporter
+        if self.metrics is None:
+            self.metrics = VROMetrics()
+            for node in self.endpoints.nodes:
+                node.pool.metrics = self.metrics
+        self.metrics.exporter = exporter
+
+    def _timed_out(self, executions, states):
+        if self.exporter:
+            for workflow_id, execution_id in executions:
+                if states.get(execution_id) == 'timeout':
+                    self.exporter.finished(workflow_id, execution_id, 'timeout')
+        return states
+
+    def completed_execution(self, workflow_id, inputs):
+        """
+        Execution of the workflow with the same inputs that completed within
+        idempotency_ttl, from the run cache and/or the recent completed runs,
+        or None
+        """
+        if self.idempotency == 'off':
+            return None
+
+        inputs = self.prepare_inputs(workflow_id, inputs)
+        digest = inputs_digest(workflow_id, inputs)
+
+        if self.idempotency in ('cache', 'both'):
+            cache_key = self.run_cache.key(self.server, self.port, digest)
+            execution_id = self.run_cache.get(cache_key)
+            if execution_id:
+                try:
+                    if self.run_workflow_state(workflow_id, execution_id) == 'completed':
+                        self.reused += 1
+                        return execution_id
+                except VROError as err:
+                    if err.status != 404:
+                        raise
+                self.run_cache.invalidate(cache_key)
+
+        # SecureString values are not returned by vRO, so cannot be matched
+        secure = [x for x in (inputs or {}).get('parameters', [])
+                  if x.get('type') == 'SecureString']
+        if self.idempotency in ('history', 'both') and not secure:
+            since = int((time.time() - self.idempotency_ttl) * 1000)
+            for run in self.iter_wf_runs(workflow_id, 'completed', since,
+                                         max_results=self.idempotency_history):
+                self.history_checked += 1
+                detail = self.run_workflow_result(workflow_id, run['id'])
+                if inputs_digest(workflow_id, {'parameters': detail.get('input-parameters')}) \
+                        == digest:
+                    self.reused += 1
+                    self.remember_execution(workflow_id, inputs, run['id'])
+                    return run['id']
+
+        return None
+
+    def remember_execution(self, workflow_id, inputs, execution_id):
+        """
+        Record a completed execution in the run cache
+        """
+        if self.idempotency in ('cache', 'both'):
+            inputs = self.prepare_inputs(workflow_id, inputs)
+            self.run_cache.set(self.run_cache.key(self.server, self.port,
+                                                  inputs_digest(workflow_id, inputs)),
+                               execution_id)
+
+    def run_workflows(self, batch, workflow_name=None, workflow_id=None):
+
+        # the inputs of every item are compiled before the first launch, so
+        # that a mistake in any of them fails the batch before it starts
+        items = []
+        for item in batch:
+            item_name = item.get('name')
+            item_id = item.get('uuid')
+
+            if not item_name and not item_id:
+                item_name = workflow_name
+                item_id = workflow_id
+
+            inputs = item.get('inputs')
+            if item_name:
+                item_id, inputs = self.named_workflow(
+                    item_name, lambda x: self.prepare_inputs(x, inputs))
+            elif item_id:
+                inputs = self.prepare_inputs(item_id, inputs)
+            else:
+                self._fail("No workflow name or uuid for batch item: {}".format(item))
+
+            items.append((item_name, item_id, inputs))
+
+        executions = []
+
+        for item_name, item_id, inputs in items:
+            if self.idempotency != 'off':
+                item_id, execution_id = self.named_workflow(
+                    item_name, lambda x: self.completed_execution(x, inputs), item_id)
+                if execution_id:
+                    executions.append({'workflow_id': item_id,
+                                       'execution_id': execution_id,
+                                       'reused': True})
+                    continue
+
+            item_id, execution_id = self.named_workflow(
+                item_name, lambda x: self.run_workflow(x, inputs), item_id)
+
+            executions.append({'workflow_id': item_id,
+                               'execution_id': execution_id})
+
+        return executions
+
+    def run_workflow_state(self, workflow_id, execution_id):
+
+        path = "workflows/{}/executions/{}/state".format(workflow_id, execution_id)
+
+        status_code, status_url, status_info, data = self._do_get(path)
+
+        if status_code != 200:
+            fail_msg = "Failed to get state workflow: {} " \
+                       "execution id: {}".format(workflow_id, execution_id)
+            self._fail(fail_msg)
+
+        return data['value']
+
+    def run_workflow_result(self, workflow_id, execution_id):
+
+        path = "workflows/{}/executions/{}/".format(workflow_id, execution_id)
+
+        status_code, status_url, status_info, data = self._do_get(path)
+
+        if status_code != 200:
+            fail_msg = "Failed to get state workflow: {} " \
+                       "execution id: {}".format(workflow_id, execution_id)
+            self._fail(fail_msg)
+
+        return data
+
+    def execution_result(self, workflow_id, execution_id):
+        """
+        Execution document trimmed by the result_* options, counting the
+        JSON size of what was fetched and of what is kept
+        """
+        data = self.run_workflow_result(workflow_id, execution_id)
+        result = project_result(data, **self.result_projection)
+
+        with self.governor_lock:
+            self.results += 1
+            self.result_bytes_fetched += len(json.dumps(data))
+            self.result_bytes_kept += len(json.dumps(result))
+
+        return result
+
+    def run_workflow_logs(self, workflow_id, execution_id, max_results=100):
+
+        path = "workflows/{}/executions/{}/logs?maxResult={}".format(
+            workflow_id, execution_id, max_results)
+
+        status_code, status_url, status_info, data = self._do_get(path)
+
+        return (data or {}).get('logs', [])
+
+    def tail_execution(self, workflow_id, execution_id, workflow_state):
+        """
+        Record a polled state in the log_file and, at most every
+        log_interval seconds and once more when the execution has finished,
+        append its new log entries.  Failing to fetch the log never fails
+        the wait.
+        """
+        tail = self.log_tail
+        if tail is None:
+            return
+
+        tail.state(execution_id, workflow_state)
+        if not tail.due(execution_id, workflow_state in self.TERMINAL_STATES):
+            return
+        try:
+            tail.append(execution_id, self.run_workflow_logs(workflow_id, execution_id,
+                                                             tail.page_size))
+        except VROError:
+            with tail.lock:
+                tail.errors += 1
+
+    def wait_for_workflow(self, workflow_id, execution_id, timeout):
+
+        states = self.wait_for_workflows([(workflow_id, execution_id)],
+                                         timeout)
+
+        return states[execution_id]
+
+    def poll_scheduler(self, workflow_id):
+
+        scheduler = self.scheduler_class(self.poll_initial_interval,
+                                         self.poll_max_interval,
+                                         self.poll_backoff,
+                                         self.poll_jitter)
+
+        if self.poll_seed_from_history:
+            scheduler.seed(self.history_statistics(workflow_id)['duration']['p50'])
+
+        return scheduler
+
+    def workflow_statistics(self, workflow_id, since=None, until=None,
+                            max_results=None):
+
+        states = {}
+        durations = array('d')
+        first = last = None
+
+        for run in self.iter_wf_runs(workflow_id, None, since, until, max_results):
+            states[run['state']] = states.get(run['state'], 0) + 1
+            start = parse_vro_date(run['start_date'])
+            end = parse_vro_date(run['end_date'])
+            if start is not None:
+                first = start if first is None else min(first, start)
+                last = start if last is None else max(last, start)
+            if run['state'] == 'completed' and start is not None and \
+                    end is not None and end >= start:
+                durations.append(end - start)
+
+        return run_statistics(states, durations,
+                              parse_vro_date(since) or first,
+                              parse_vro_date(until) or last)
+
+    def history_statistics(self, workflow_id):
+
+        if workflow_id not in self.statistics:
+            self.statistics[workflow_id] = self.workflow_statistics(
+                workflow_id, max_results=self.HISTORY_RUNS)
+
+        return self.statistics[workflow_id]
+
+    def history_timeout(self, workflow_ids, default):
+
+        if not self.timeout_from_history:
+            return default
+
+        timeouts = [self.history_statistics(x)['recommended_timeout']
+                    for x in set(workflow_ids)]
+        if None in timeouts or not timeouts:
+            return default
+
+        return max(timeouts)
+
+    def wait_for_workflows(self, executions, timeout, until_any=False):
+
+        # executions already seen finished, such as those waited on by
+        # hold_launch, are not polled again
+        known = dict((x[1], self.seen_finished[x[1]]) for x in executions
+                     if x[1] in self.seen_finished)
+        executions = [x for x in executions if x[1] not in known]
+
+        started = timer()
+        try:
+            # with one already finished, until_any leaves the others pending
+            states = dict((x[1], None) for x in executions) if until_any and known else {}
+            if executions and not states:
+                states = self._wait_for_workflows(executions, timeout, until_any)
+            states.update(known)
+            return states
+        finally:
+            if self.profiler:
+                self.profiler.add('wait', timer() - started)
+
+    def _wait_for_workflows(self, executions, timeout, until_any=False):
+
+        # launches still buffered reach the journal before the long wait
+        if self.journal:
+            self.journal.flush()
+
+        if self.agent_socket and not self.log_tail:
+            started = time.time()
+            states = self.agent_wait(executions, timeout, until_any)
+            if states is not None:
+                for workflow_id, execution_id in executions:
+                    if states.get(execution_id) in self.TERMINAL_STATES:
+                        self._finished(workflow_id, execution_id, states[execution_id])
+                return self._timed_out(executions, states)
+            timeout = max(0, timeout - (time.time() - started))
+
+        if self.wait_strategy == 'listing':
+            return self._timed_out(executions,
+                                   self.wait_by_listing(executions, timeout, until_any))
+
+        deadline = time.time() + timeout
+        schedulers = {}
+        pending = []
+        for seq, (workflow_id, execution_id) in enumerate(executions):
+            schedulers[execution_id] = self.poll_scheduler(workflow_id)
+            pending.append((0, seq, workflow_id, execution_id))
+        heapq.heapify(pending)
+        polling = [0]
+        errors = []
+        slept = {}
+        states = {}
+        last_states = {}
+        cond = threading.Condition()
+
+        def next_execution():
+            with cond:
+                while not errors and not (until_any and states):
+                    now = time.time()
+                    if pending and pending[0][0] <= now:
+                        polling[0] += 1
+                        return heapq.heappop(pending)[1:]
+                    if now >= deadline or not (pending or polling[0]):
+                        return None
+                    wake = min(pending[0][0], deadline) if pending else deadline
+                    cond.wait(wake - now)
+
+        def poller():
+            while True:
+                execution = next_execution()
+                if execution is None:
+                    return
+
+                seq, workflow_id, execution_id = execution
+                workflow_state = None
+                try:
+                    workflow_state = self.run_workflow_state(workflow_id,
+                                                             execution_id)
+                    self.tail_execution(workflow_id, execution_id, workflow_state)
+                except VROError as err:
+                    errors.append(err)
+
+                with cond:
+                    polling[0] -= 1
+                    self.polls += 1
+                    now = time.time()
+                    last_states[execution_id] = workflow_state
+                    if workflow_state in self.TERMINAL_STATES:
+                        states[execution_id] = workflow_state
+                        self.wasted_wait += slept.get(execution_id, 0)
+                        self._finished(workflow_id, execution_id, workflow_state)
+                    elif workflow_state is not None and now < deadline:
+                        # never sleep past the deadline, poll once more there
+                        interval = min(schedulers[execution_id].next_interval(),
+                                       deadline - now)
+                        slept[execution_id] = interval
+                        heapq.heappush(pending, (now + interval, seq,
+                                                 workflow_id, execution_id))
+                    cond.notify_all()
+
+        workers = []
+        for dummy in range(max(1, min(self.poll_concurrency, len(pending)))):
+            worker = threading.Thread(target=poller)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+
+        if errors:
+            raise errors[0]
+
+        # executions until_any left unpolled are still pending, with no state
+        timed_out = time.time() >= deadline
+        for workflow_id, execution_id in executions:
+            if execution_id not in last_states:
+                states.setdefault(execution_id, None)
+            elif timed_out:
+                states.setdefault(execution_id, 'timeout')
+            else:
+                states.setdefault(execution_id, last_states[execution_id])
+
+        return self._timed_out(executions, states)
+
+    def agent_wait(self, executions, timeout, until_any=False):
+        """
+        Hand the wait to the vro_agent.py agent listening on agent_socket,
+        returning the states it answers, or None when no agent answered
+        """
+        owners = dict((x[1], self.endpoints.owners[x[1]].name) for x in executions
+                      if x[1] in self.endpoints.owners)
+        request = {'action': 'wait', 'server': self.server, 'port': self.port,
+                   'username': self.user, 'password': self.pwd,
+                   'options': self.agent_options, 'owners': owners,
+                   'executions': [list(x) for x in executions],
+                   'timeout': timeout, 'until_any': until_any}
+
+        agent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        agent.settimeout(timeout + 60)
+        try:
+            agent.connect(os.path.expanduser(self.agent_socket))
+            agent.sendall((json.dumps(request) + "\n").encode('utf-8'))
+            response = json.loads(agent.makefile('rb').readline().decode('utf-8'))
+        except (socket.error, ValueError):
+            self.agent_fallbacks += 1
+            return None
+        finally:
+            agent.close()
+
+        self.agent_waits += 1
+        if 'error' in response:
+            raise VROError(response['error'], response.get('status'))
+        return response['states']
+
+    def listing_states(self, workflow_id, execution_ids):
+        """
+        States of executions of one workflow, read from the executions
+        listing, newest first, until all are found.  Executions missing
+        from the first LISTING_RUNS runs are read from their detail.
+        """
+        wanted = set(execution_ids)
+        states = {}
+        page_size = 100
+        requests = 0
+
+        if len(wanted) > 1:
+            seen = 0
+            for run in self.iter_wf_runs(workflow_id, max_results=self.LISTING_RUNS,
+                                         page_size=page_size):
+                seen += 1
+                if run['id'] in wanted:
+                    states[run['id']] = run['state']
+                    if len(states) == len(wanted):
+                        break
+            requests += max(1, -(-seen // page_size))
+
+        for execution_id in wanted - set(states):
+            states[execution_id] = self.run_workflow_result(workflow_id,
+                                                            execution_id)['state']
+            requests += 1
+
+        # paging through more runs than there are executions saves nothing
+        with self.governor_lock:
+            self.polls += requests
+            self.requests_saved += max(0, len(wanted) - requests)
+
+        return states
+
+    def wait_by_listing(self, executions, timeout, until_any=False):
+        """
+        Wait like wait_for_workflows, but poll each workflow's executions
+        listing once per round instead of the state of every execution, so
+        that the requests made scale with the number of workflows rather
+        than the number of executions
+        """
+        deadline = time.time() + timeout
+        scheduler = self.scheduler_class(self.poll_initial_interval,
+                                         self.poll_max_interval,
+                                         self.poll_backoff,
+                                         self.poll_jitter)
+        pending = {}
+        for workflow_id, execution_id in executions:
+            pending.setdefault(workflow_id, set()).add(execution_id)
+
+        if self.poll_seed_from_history:
+            durations = [self.history_statistics(x)['duration']['p50'] for x in pending]
+            scheduler.seed(min([x for x in durations if x] or [None]))
+
+        states = {}
+        interval = 0
+        while pending:
+            rounds = self.map_concurrent(lambda x: self.listing_states(*x),
+                                         list(pending.items()))
+            for workflow_id, found in zip(list(pending), rounds):
+                for execution_id, workflow_state in found.items():
+                    states[execution_id] = workflow_state
+                    self.tail_execution(workflow_id, execution_id, workflow_state)
+                    if workflow_state in self.TERMINAL_STATES:
+                        pending[workflow_id].discard(execution_id)
+                        self.wasted_wait += interval
+                        self._finished(workflow_id, execution_id, workflow_state)
+                if not pending[workflow_id]:
+                    del pending[workflow_id]
+
+            finished = [x for x in states.values() if x in self.TERMINAL_STATES]
+            now = time.time()
+            if (until_any and finished) or not pending or now >= deadline:
+                break
+            # never sleep past the deadline, poll once more there
+            interval = min(scheduler.next_interval(), deadline - now)
+            time.sleep(interval)
+
+        for workflow_id, execution_ids in pending.items():
+            for execution_id in execution_ids:
+                if execution_id not in states:
+                    states[execution_id] = None
+                elif time.time() >= deadline:
+                    states[execution_id] = 'timeout'
+
+        return states
+
+    def collect_workflows(self, executions, timeout, wait=True, until_any=False):
+
+        pairs = [(x['workflow_id'], x['execution_id']) for x in executions]
+
+        if wait:
+            states = self.wait_for_workflows(pairs, timeout, until_any)
+        else:
+            states = dict(zip([x[1] for x in pairs],
+                              self.map_concurrent(lambda x: self.run_workflow_state(*x),
+                                                  pairs)))
+            for workflow_id, execution_id in pairs:
+                if states[execution_id] in self.TERMINAL_STATES:
+                    self._finished(workflow_id, execution_id, states[execution_id])
+
+        completed = [x for x in pairs if states[x[1]] == 'completed']
+        results = dict(zip([x[1] for x in completed],
+                           self.map_concurrent(lambda x: self.execution_result(*x),
+                                               completed)))
+
+        collected = []
+        for workflow_id, execution_id in pairs:
+            execution = {'workflow_id': workflow_id,
+                         'execution_id': execution_id,
+                         'status': states[execution_id]}
+            if execution_id in results:
+                execution['result'] = results[execution_id]
+            collected.append(execution)
+
+        return collected
+
+    def resume_workflows(self, timeout, wait=True, until_any=False):
+        """
+        Collect the executions the journal shows were launched on these nodes
+        but not seen finished, returning them and the number of executions
+        already finished.  Completed ones are remembered for idempotency.
+        """
+        pending, finished = self.journal.pending([x.name for x in self.endpoints.nodes])
+        for record in pending:
+            self.endpoints.adopt(record['execution_id'], record['server'])
+
+        collected = self.collect_workflows(pending, timeout, wait, until_any)
+
+        for record, execution in zip(pending, collected):
+            if execution['status'] == 'completed' and self.idempotency in ('cache', 'both'):
+                self.run_cache.set(self.run_cache.key(self.server, self.port,
+                                                      record['inputs']),
+                                   record['execution_id'])
+
+        return collected, finished
+
+    def iter_wf_runs(self, workflow_id, run_state=None, since=None, until=None,
+                     max_results=None, page_size=100):
+        """
+        Yield a summary of each run of the workflow, newest first, fetching
+        one page of the executions listing at a time and stopping as soon as
+        max_results runs or a run older than since have been seen
+        """
+        runs = RunFilter(run_state, since, until, max_results, page_size)
+
+        start = 0
+        while not runs.done:
+            path = runs_path(workflow_id, runs.page_size, start, run_state)
+
+            status_code, status_url, status_info, data = self._do_get(path)
+
+            if status_code != 200:
+                self._fail("Failed getting runs for workflow: "
+                           "id: {}".format(workflow_id))
+
+            relations = (data or {}).get('relations', {})
+            links = relations.get('link', [])
+
+            for run in runs.select(links):
+                yield run
+
+            start += len(links)
+            if len(links) < runs.page_size or start >= relations.get('total', 0):
+                return
+
+    def get_wf_run_status(self, workflow_id, since=None, until=None,
+                          max_results=None):
+
+        return [run['id'] for run in self.iter_wf_runs(workflow_id, 'failed',
+                                                       since, until,
+                                                       max_results)]
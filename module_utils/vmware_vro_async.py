@@ -0,0 +1,405 @@
+# Copyright (c) 2018 Tony Skidmore (@tonyskidmore) <tony@skidmore.co.uk>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+#
+# asyncio client for the vRO REST API, for Python services that drive many
+# workflows outside Ansible.  It offers the operations of VROClient in
+# vmware_vro.py as coroutines over a shared keep-alive connection pool and
+# raises VROError instead of exiting.  Requires Python 3.6 or later.
+#
+# Example:
+#
+#   async with AsyncVROClient('vro.domain.local', 8281, 'vcoadmin', 'secret') as vro:
+#       workflow_id = await vro.workflow_id('test-workflow')
+#       execution_id = await vro.run_workflow(workflow_id, inputs)
+#       state = await vro.wait_for_workflow(workflow_id, execution_id, 600)
+
+from __future__ import absolute_import, division, print_function
+
+import asyncio
+import base64
+import json
+import socket
+import ssl
+import time
+
+from .vmware_vro import (PollScheduler, RetryPolicy, RunFilter, TokenBucket,
+                         VROClient, VROError, WorkflowIdCache,
+                         compile_inputs, execution_id_from_location, fail,
+                         inputs_json, runs_path, workflow_id_from_listing)
+
+# VROError is re-exported so that callers can catch it from this module
+__all__ = ['AsyncVROClient', 'AsyncVROConnectionPool', 'AsyncVROResponse', 'VROError']
+
+
+class AsyncVROResponse(object):
+    """
+    Status, headers and body of a response read from an asyncio stream
+    """
+
+    def __init__(self, status, reason, headers, data, will_close):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+        self.will_close = will_close
+
+
+class AsyncVROConnectionPool(object):
+    """
+    Keep-alive HTTP/1.1 connections to a vRO appliance over asyncio streams,
+    shared by all coroutines of one event loop
+    """
+
+    def __init__(self, server, port, validate_certs, size=8, idle_timeout=15,
+                 timeout=10):
+        self.server = server
+        self.port = int(port)
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.context = ssl.create_default_context()
+        if not validate_certs:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.slots = None
+        self.idle = []
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    async def _connect(self):
+        self.connections_opened += 1
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server, self.port, ssl=self.context),
+            self.timeout)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer
+
+    def _checkout(self):
+        now = time.time()
+        while self.idle:
+            reader, writer, last_used = self.idle.pop()
+            if now - last_used < self.idle_timeout and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def _exchange(self, reader, writer, method, path, body, headers):
+        body = body.encode('utf-8') if isinstance(body, str) else (body or b'')
+        lines = ['{} {} HTTP/1.1'.format(method, path),
+                 'Host: {}:{}'.format(self.server, self.port),
+                 'Content-Length: {}'.format(len(body))]
+        lines.extend('{}: {}'.format(k, v) for k, v in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Remote end closed connection without response")
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n')
+                                   .split(' ', 2) + [''])[:3]
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            response_headers[name.strip().lower()] = value.strip()
+
+        will_close = version == 'HTTP/1.0' or \
+            response_headers.get('connection', '').lower() == 'close'
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        elif int(status) in (204, 304):
+            data = b''
+        else:
+            data = await reader.read()
+            will_close = True
+
+        return AsyncVROResponse(int(status), reason, response_headers, data, will_close)
+
+    async def request(self, method, path, body=None, headers=None):
+        """
+        Send a request and return the response.  A GET on a reused
+        connection that the server has since closed is retried once on a
+        new connection.  Connection errors carry request_sent, false when
+        they happened before any of the request was written.
+        """
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+
+        async with self.slots:
+            conn = self._checkout()
+            reused = conn is not None
+            while True:
+                self.requests_sent += 1
+                sent = False
+                try:
+                    if conn is None:
+                        conn = await self._connect()
+                    sent = True
+                    resp = await asyncio.wait_for(
+                        self._exchange(conn[0], conn[1], method, path, body,
+                                       headers or {}),
+                        self.timeout)
+                except (OSError, asyncio.IncompleteReadError,
+                        asyncio.TimeoutError) as err:
+                    if conn is not None:
+                        conn[1].close()
+                    if reused and method == 'GET' and \
+                            not isinstance(err, asyncio.TimeoutError):
+                        conn, reused = None, False
+                        continue
+                    err.request_sent = sent
+                    raise
+                break
+
+            if resp.will_close:
+                conn[1].close()
+            else:
+                self.idle.append((conn[0], conn[1], time.time()))
+
+            return resp
+
+    async def close(self):
+        while self.idle:
+            reader, writer, last_used = self.idle.pop()
+            writer.close()
+
+    def stats(self):
+        return {'connections_opened': self.connections_opened,
+                'requests_sent': self.requests_sent}
+
+
+class AsyncVROClient(object):
+    """
+    asyncio counterpart of VROClient
+    """
+
+    API_PATH = VROClient.API_PATH
+    TERMINAL_STATES = VROClient.TERMINAL_STATES
+
+    def __init__(self, server, port, username, password, validate_certs=True,
+                 pool_size=8, pool_idle_timeout=15, poll_concurrency=8,
+                 poll_initial_interval=0.25, poll_max_interval=5.0,
+                 poll_backoff=1.5, poll_jitter=0.1, cache_file=None,
+                 cache_ttl=86400, rate_limit=0, rate_limit_burst=None,
+                 retries=3, retry_interval=0.5, retry_max_interval=30.0):
+        self.server = server
+        self.port = port
+        credentials = "{}:{}".format(username, password).encode('utf-8')
+        self.headers = {'Content-Type': 'application/json',
+                        'Accept': 'application/json',
+                        'Authorization': 'Basic {}'.format(
+                            base64.b64encode(credentials).decode('ascii'))}
+        self.poll_concurrency = poll_concurrency
+        self.poll_options = (poll_initial_interval, poll_max_interval,
+                             poll_backoff, poll_jitter)
+        self.scheduler_class = PollScheduler
+        self.cache = WorkflowIdCache(cache_file, cache_ttl)
+        self.pool = AsyncVROConnectionPool(server, port, validate_certs,
+                                           size=pool_size,
+                                           idle_timeout=pool_idle_timeout)
+        self.rate_limiter = TokenBucket(rate_limit, rate_limit_burst) \
+            if rate_limit else None
+        self.retry_policy = RetryPolicy(retries, retry_interval,
+                                        retry_max_interval)
+        self.polls = 0
+        self.throttled = 0
+        self.throttle_wait = 0.0
+        self.retried = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await self.pool.close()
+
+    def stats(self):
+        return {'cache_stats': self.cache.stats(),
+                'connection_stats': self.pool.stats(),
+                'poll_stats': {'polls': self.polls},
+                'governor_stats': {'throttled': self.throttled,
+                                   'throttle_wait': round(self.throttle_wait, 3),
+                                   'retried': self.retried}}
+
+    async def _throttle(self):
+        if self.rate_limiter is None:
+            return
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            self.throttled += 1
+            self.throttle_wait += delay
+            await asyncio.sleep(delay)
+
+    async def _retry_wait(self, attempt, retry_after=None):
+        self.retried += 1
+        await asyncio.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    async def _do_send(self, method, path, data=None):
+
+        if data is None and method == 'POST':
+            data = "{}"
+
+        attempt = 0
+        while True:
+            await self._throttle()
+            try:
+                resp = await self.pool.request(method, self.API_PATH.format(path),
+                                               data, self.headers)
+            except (ssl.SSLError, ssl.CertificateError) as err:
+                fail("Error validating the server's certificate: %s" % (str(err)))
+            except socket.gaierror as err:
+                fail("Failed lookup url: %s" % (str(err)))
+            except (OSError, asyncio.IncompleteReadError,
+                    asyncio.TimeoutError) as err:
+                if not self.retry_policy.retry_error(attempt, method, err):
+                    fail("Error connecting: %s" % (str(err) or 'timed out'))
+                await self._retry_wait(attempt)
+                attempt += 1
+                continue
+
+            if not self.retry_policy.retry_status(attempt, resp.status):
+                break
+            await self._retry_wait(attempt, resp.headers.get('retry-after'))
+            attempt += 1
+
+        if resp.status >= 400:
+            fail("Received HTTP error: HTTP Error %s: %s" % (resp.status, resp.reason),
+                 resp.status)
+
+        try:
+            data = json.loads(resp.data) if resp.data else None
+        except ValueError:
+            fail("Unable to convert to JSON")
+
+        return resp.status, resp.headers, data
+
+    async def workflow_id(self, wf_name, refresh=False):
+
+        cache_key = self.cache.key(self.server, self.port, wf_name)
+        if not refresh:
+            wf_href = self.cache.get(cache_key)
+            if wf_href:
+                return wf_href
+
+        path = 'workflows?conditions=name={}'.format(wf_name)
+
+        status_code, headers, data = await self._do_send('GET', path)
+
+        wf_href = workflow_id_from_listing(wf_name, data)
+        self.cache.set(cache_key, wf_href)
+
+        return wf_href
+
+    async def run_workflow(self, workflow_id, inputs):
+
+        path = "workflows/{}/executions/".format(workflow_id)
+
+        # shorthand inputs are typed by their values, there is no signature here
+        json_data = inputs_json(compile_inputs(inputs))
+
+        status_code, headers, data = await self._do_send('POST', path, json_data)
+
+        if status_code != 202:
+            fail("POST failed with status code: {}".format(status_code))
+
+        return execution_id_from_location(headers['location'])
+
+    async def run_workflow_state(self, workflow_id, execution_id):
+
+        path = "workflows/{}/executions/{}/state".format(workflow_id, execution_id)
+
+        status_code, headers, data = await self._do_send('GET', path)
+
+        return data['value']
+
+    async def run_workflow_result(self, workflow_id, execution_id):
+
+        path = "workflows/{}/executions/{}/".format(workflow_id, execution_id)
+
+        status_code, headers, data = await self._do_send('GET', path)
+
+        return data
+
+    async def iter_wf_runs(self, workflow_id, run_state=None, since=None,
+                           until=None, max_results=None, page_size=100):
+
+        runs = RunFilter(run_state, since, until, max_results, page_size)
+
+        start = 0
+        while not runs.done:
+            path = runs_path(workflow_id, runs.page_size, start, run_state)
+
+            status_code, headers, data = await self._do_send('GET', path)
+
+            relations = (data or {}).get('relations', {})
+            links = relations.get('link', [])
+
+            for run in runs.select(links):
+                yield run
+
+            start += len(links)
+            if len(links) < runs.page_size or start >= relations.get('total', 0):
+                return
+
+    async def wait_for_workflow(self, workflow_id, execution_id, timeout):
+
+        states = await self.wait_for_workflows([(workflow_id, execution_id)],
+                                               timeout)
+
+        return states[execution_id]
+
+    async def wait_for_workflows(self, executions, timeout, until_any=False):
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        slots = asyncio.Semaphore(self.poll_concurrency)
+        states = {}
+        finished = asyncio.Event()
+
+        async def wait(workflow_id, execution_id):
+            scheduler = self.scheduler_class(*self.poll_options)
+            while not (until_any and finished.is_set()):
+                async with slots:
+                    workflow_state = await self.run_workflow_state(workflow_id,
+                                                                   execution_id)
+                self.polls += 1
+                states[execution_id] = workflow_state
+                if workflow_state in self.TERMINAL_STATES:
+                    finished.set()
+                    return
+                now = loop.time()
+                if now >= deadline:
+                    states[execution_id] = 'timeout'
+                    return
+                await asyncio.sleep(min(scheduler.next_interval(), deadline - now))
+
+        tasks = [asyncio.ensure_future(wait(*x)) for x in executions]
+        try:
+            if until_any:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                finished.set()
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return states
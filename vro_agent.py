@@ -0,0 +1,287 @@
+#!/usr/bin/python
+"""
+Local polling agent for the vmware_vro_workflow.py Ansible module
+
+Ansible forks running the module with agent_socket set hand the executions
+they wait on to this process over a Unix socket instead of polling vRO
+themselves.  The agent keeps one VROClient, and so one keep-alive connection
+pool, per appliance and credentials, polls the executions listing of each
+workflow being waited on once per round for all tasks together, and answers
+each task as soon as its executions have finished.  Tasks fall back to
+polling directly when the agent is not running.
+
+With --metrics-listen the agent also serves Prometheus metrics of the
+executions it watches and of its vRO API calls on http://HOST:PORT/metrics.
+"""
+
+from __future__ import print_function
+
+try:
+    import argparse
+    import json
+    import os
+    import socketserver
+    import sys
+    import threading
+    import time
+    from module_utils.vmware_vro import VROClient, VROError, VROExporter, parse_endpoint
+    HAS_MODULES = True
+except ImportError:
+    HAS_MODULES = False
+
+SOCKET = os.path.join(os.path.expanduser('~'), '.ansible', 'vro-agent.sock')
+
+
+class ExecutionWatcher(object):
+    """
+    Executions waited on through one VROClient, polled by a single thread a
+    workflow's executions listing at a time
+    """
+
+    def __init__(self, vro, interval=0.5, max_interval=5.0, backoff=1.5, exporter=None):
+        self.vro = vro
+        self.exporter = exporter
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.states = {}
+        self.errors = {}
+        self.waiters = {}
+        self.rounds = 0
+        self.waits = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def poll(self, item):
+        # any failure is handed to the waiters, never ends the poller thread
+        try:
+            return self.vro.listing_states(*item)
+        except Exception as err:
+            return err
+
+    def run(self):
+        interval = self.interval
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                    interval = self.interval
+                by_workflow = {}
+                for execution_id, workflow_id in self.pending.items():
+                    by_workflow.setdefault(workflow_id, []).append(execution_id)
+
+            try:
+                rounds = self.vro.map_concurrent(self.poll, list(by_workflow.items()))
+            except Exception as err:
+                rounds = [err] * len(by_workflow)
+
+            with self.cond:
+                self.rounds += 1
+                for (workflow_id, execution_ids), found in zip(by_workflow.items(), rounds):
+                    if isinstance(found, Exception):
+                        self.errors.update((x, str(found) or repr(found))
+                                           for x in execution_ids)
+                        found = dict((x, None) for x in execution_ids)
+                    for execution_id, workflow_state in found.items():
+                        self.states[execution_id] = workflow_state
+                        if workflow_state in VROClient.TERMINAL_STATES and self.exporter and \
+                                execution_id in self.pending:
+                            self.exporter.finished(workflow_id, execution_id, workflow_state)
+                        if workflow_state in VROClient.TERMINAL_STATES or \
+                                execution_id in self.errors:
+                            self.pending.pop(execution_id, None)
+                self.cond.notify_all()
+                # new executions wake the poller early, resetting the interval
+                if self.cond.wait(interval):
+                    interval = self.interval
+                else:
+                    interval = min(interval * self.backoff, self.max_interval)
+
+    def wait(self, executions, timeout, until_any=False):
+        """
+        States of the executions once all have finished, or any has with
+        until_any, or timeout for those still running at the deadline
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            self.waits += 1
+            for workflow_id, execution_id in executions:
+                self.waiters[execution_id] = self.waiters.get(execution_id, 0) + 1
+                if self.states.get(execution_id) not in VROClient.TERMINAL_STATES:
+                    self.pending[execution_id] = workflow_id
+                    if self.exporter:
+                        self.exporter.watching(workflow_id, execution_id)
+            self.cond.notify_all()
+
+            try:
+                while True:
+                    finished = [x for x in executions
+                                if self.states.get(x[1]) in VROClient.TERMINAL_STATES]
+                    errors = [self.errors[x[1]] for x in executions if x[1] in self.errors]
+                    if errors:
+                        raise VROError(errors[0])
+                    if len(finished) == len(executions) or (until_any and finished):
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+
+                # executions not polled yet are only timed out at the deadline
+                timed_out = time.time() >= deadline
+                states = {}
+                for workflow_id, execution_id in executions:
+                    workflow_state = self.states.get(execution_id)
+                    if workflow_state not in VROClient.TERMINAL_STATES and timed_out:
+                        workflow_state = 'timeout'
+                        if self.exporter:
+                            self.exporter.finished(workflow_id, execution_id, workflow_state)
+                    states[execution_id] = workflow_state
+                return states
+            finally:
+                for workflow_id, execution_id in executions:
+                    self.waiters[execution_id] -= 1
+                    if not self.waiters[execution_id]:
+                        del self.waiters[execution_id]
+                        self.pending.pop(execution_id, None)
+                        self.states.pop(execution_id, None)
+                        self.errors.pop(execution_id, None)
+                        if self.exporter:
+                            self.exporter.forget(execution_id)
+
+    def stats(self):
+        with self.cond:
+            return {'pending': len(self.pending), 'waiters': len(self.waiters),
+                    'rounds': self.rounds, 'waits': self.waits}
+
+
+class VROAgent(object):
+    """ ExecutionWatchers by appliance, credentials and connection options """
+
+    def __init__(self, interval=0.5, max_interval=5.0, exporter=None):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.exporter = exporter
+        self.lock = threading.Lock()
+        self.watchers = {}
+
+    def watcher(self, request):
+        options = dict((k, v) for k, v in request.get('options', {}).items()
+                       if k in VROClient.AGENT_OPTIONS)
+        key = json.dumps([request['server'], request['port'], request['username'],
+                          request['password'], options], sort_keys=True)
+        with self.lock:
+            if key not in self.watchers:
+                vro = VROClient(request['server'], request['port'], request['username'],
+                                request['password'], **options)
+                if self.exporter:
+                    vro.export(self.exporter)
+                self.watchers[key] = ExecutionWatcher(vro, self.interval, self.max_interval,
+                                                      exporter=self.exporter)
+            return self.watchers[key]
+
+    def handle(self, request):
+        if request.get('action') == 'stats':
+            with self.lock:
+                watchers = list(self.watchers.values())
+            return {'watchers': [x.stats() for x in watchers]}
+
+        if request.get('action') != 'wait':
+            return {'error': "Unknown action: {}".format(request.get('action'))}
+
+        watcher = self.watcher(request)
+        for execution_id, name in request.get('owners', {}).items():
+            watcher.vro.endpoints.adopt(execution_id, name)
+        try:
+            states = watcher.wait([tuple(x) for x in request['executions']],
+                                  request['timeout'], request.get('until_any', False))
+        except VROError as err:
+            return {'error': str(err), 'status': err.status}
+        return {'states': states}
+
+
+class VROAgentHandler(socketserver.StreamRequestHandler):
+    """ one JSON request and one JSON response per line """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.agent.handle(json.loads(line.decode('utf-8')))
+            except (KeyError, TypeError, ValueError) as err:
+                response = {'error': "Invalid request: {}".format(err)}
+            self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+
+class VROAgentServer(socketserver.ThreadingUnixStreamServer):
+    """ Unix socket server of a VROAgent, readable by its owner only """
+
+    daemon_threads = True
+
+    def __init__(self, path, agent):
+        if os.path.exists(path):
+            os.unlink(path)
+        socket_dir = os.path.dirname(path) or '.'
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.ThreadingUnixStreamServer.__init__(self, path, VROAgentHandler)
+        finally:
+            os.umask(old_umask)
+        self.agent = agent
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        os.unlink(self.server_address)
+
+
+def main():
+    """ main function """
+
+    if not HAS_MODULES:
+        print("The required modules could not be loaded")
+        sys.exit(1)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-S', '--socket', type=str, default=SOCKET)
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='seconds between polls right after new executions arrive')
+    parser.add_argument('--max-interval', type=float, default=5.0,
+                        help='longest seconds between polls')
+    parser.add_argument('--metrics-listen', type=str, metavar='HOST:PORT',
+                        help='serve Prometheus metrics on http://HOST:PORT/metrics')
+
+    args = parser.parse_args()
+
+    exporter = None
+    if args.metrics_listen:
+        exporter = VROExporter()
+        host, port = parse_endpoint(args.metrics_listen, 9470)
+        exporter.serve(host, port)
+        print("vRO agent metrics on http://{}:{}/metrics".format(host, port))
+
+    server = VROAgentServer(os.path.expanduser(args.socket),
+                            VROAgent(args.interval, args.max_interval, exporter))
+    print("vRO agent listening on {}".format(server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(server.server_address)
+
+
+if __name__ == '__main__':
+    main()
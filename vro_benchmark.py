@@ -0,0 +1,286 @@
+#!/usr/bin/python
+"""
+End to end benchmark of vmware_vro_workflow.py and vro_workflow_to_ansible.py
+
+Starts a vro_mock_server.py appliance in the background, drives VROClient and
+AsyncVROClient from module_utils, the Ansible module run by ansible-playbook
+and the playbook generator against it, and reports executions per second,
+p50/p99 end to end latency and HTTP requests per execution.  Results can
+be saved and later compared against a baseline, failing when throughput or
+latency regresses beyond a tolerance.
+"""
+
+from __future__ import print_function
+
+try:
+    import argparse
+    import json
+    import os
+    import shutil
+    import subprocess
+    import sys
+    import tempfile
+    import time
+    import vro_mock_server
+    HAS_MODULES = True
+except ImportError:
+    HAS_MODULES = False
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('client-batch', 'client-async', 'client-single', 'module', 'generator',
+             'generator-cold')
+USERNAME = 'vcoadmin'
+PASSWORD = 'vcoadmin'
+INPUTS = {'parameters': [
+    {'name': 'inValue', 'type': 'string', 'scope': 'local',
+     'value': {'string': {'value': 'Executed by vro_benchmark'}}}]}
+
+
+def percentile(values, fraction):
+    """ nearest rank percentile """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summarise(executions, seconds, latencies, requests):
+    """ benchmark figures of one scenario """
+    return {'executions': executions,
+            'seconds': round(seconds, 3),
+            'executions_per_second': round(executions / seconds, 3) if seconds else None,
+            'p50_latency': round(percentile(latencies, 0.5), 4) if latencies else None,
+            'p99_latency': round(percentile(latencies, 0.99), 4) if latencies else None,
+            'requests_per_execution': round(requests / float(executions), 2)
+                                      if executions else None}
+
+
+def client(port):
+    """ VROClient talking to the mock appliance """
+    from module_utils.vmware_vro import VROClient
+
+    return VROClient('127.0.0.1', port, USERNAME, PASSWORD, validate_certs=False)
+
+
+def bench_client_batch(server, args):
+    """ one VROClient launching, waiting on and collecting a batch """
+    vro = client(server.port)
+    requests = server.vro.requests
+
+    start = time.time()
+    launched = []
+    for dummy in range(args.executions):
+        launch_time = time.time()
+        workflow_id, execution_id = vro.run_workflow_named('test-workflow', INPUTS)
+        launched.append((launch_time, workflow_id, execution_id))
+    pairs = [x[1:] for x in launched]
+    states = vro.wait_for_workflows(pairs, args.timeout)
+    done = time.time()
+    vro.map_concurrent(lambda x: vro.run_workflow_result(*x),
+                       [x for x in pairs if states[x[1]] == 'completed'])
+    seconds = time.time() - start
+
+    return summarise(args.executions, seconds, [done - x[0] for x in launched],
+                     server.vro.requests - requests)
+
+
+def bench_client_async(server, args):
+    """ one AsyncVROClient launching, waiting on and collecting a batch """
+    import asyncio
+    from module_utils.vmware_vro_async import AsyncVROClient
+
+    async def batch(vro):
+        workflow_id = await vro.workflow_id('test-workflow')
+        launched = []
+        for dummy in range(args.executions):
+            launched.append((time.time(), workflow_id,
+                             await vro.run_workflow(workflow_id, INPUTS)))
+        pairs = [x[1:] for x in launched]
+        states = await vro.wait_for_workflows(pairs, args.timeout)
+        done = time.time()
+        await asyncio.gather(*[vro.run_workflow_result(*x) for x in pairs
+                               if states[x[1]] == 'completed'])
+        return [done - x[0] for x in launched]
+
+    async def run():
+        async with AsyncVROClient('127.0.0.1', server.port, USERNAME, PASSWORD,
+                                  validate_certs=False) as vro:
+            return await batch(vro)
+
+    requests = server.vro.requests
+    start = time.time()
+    latencies = asyncio.run(run())
+
+    return summarise(args.executions, time.time() - start, latencies,
+                     server.vro.requests - requests)
+
+
+def bench_client_single(server, args):
+    """ one VROClient running executions one after the other """
+    vro = client(server.port)
+    requests = server.vro.requests
+
+    latencies = []
+    start = time.time()
+    for dummy in range(args.runs):
+        run_start = time.time()
+        workflow_id, execution_id = vro.run_workflow_named('test-workflow', INPUTS)
+        if vro.wait_for_workflow(workflow_id, execution_id, args.timeout) == 'completed':
+            vro.run_workflow_result(workflow_id, execution_id)
+        latencies.append(time.time() - run_start)
+
+    return summarise(args.runs, time.time() - start, latencies,
+                     server.vro.requests - requests)
+
+
+def bench_module(server, args):
+    """ the Ansible module run by ansible-playbook, one play per execution """
+    task = {'vmware_vro_workflow': {
+        'hostname': '127.0.0.1', 'port': str(server.port),
+        'username': USERNAME, 'password': PASSWORD, 'validate_certs': False,
+        'name': 'test-workflow', 'inputs': INPUTS, 'timeout': args.timeout}}
+    play = [{'hosts': 'localhost', 'connection': 'local', 'gather_facts': False,
+             'tasks': [task]}]
+    env = dict(os.environ, ANSIBLE_LIBRARY=os.path.join(PATH, 'library'),
+               ANSIBLE_MODULE_UTILS=os.path.join(PATH, 'module_utils'),
+               ANSIBLE_RETRY_FILES_ENABLED='False')
+    requests = server.vro.requests
+
+    work_dir = tempfile.mkdtemp()
+    playbook = os.path.join(work_dir, 'benchmark.yml')
+    with open(playbook, 'w') as playbook_file:
+        json.dump(play, playbook_file)
+
+    latencies = []
+    start = time.time()
+    try:
+        for dummy in range(args.runs):
+            run_start = time.time()
+            process = subprocess.Popen(['ansible-playbook', '-i', 'localhost,', playbook],
+                                       env=env, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+            if process.returncode:
+                raise RuntimeError("Playbook failed: {}".format(output.decode('utf-8')))
+            latencies.append(time.time() - run_start)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return summarise(args.runs, time.time() - start, latencies,
+                     server.vro.requests - requests)
+
+
+def run_generator(server, work_dir, cache_dir, workflow_id, execution_id):
+    """ one run of the playbook generator capturing an execution """
+    subprocess.check_call(
+        [sys.executable, os.path.join(PATH, 'vro_workflow_to_ansible.py'),
+         '-s', '127.0.0.1', '-l', str(server.port), '-u', USERNAME,
+         '-p', PASSWORD, '-w', workflow_id, '-e', execution_id, '-i',
+         '--template-cache', cache_dir],
+        cwd=work_dir, stdout=subprocess.DEVNULL)
+
+
+def bench_generator(server, args, warm=True):
+    """
+    the playbook generator run as a process per execution, from start up
+    to the files written, with its template cache warmed beforehand or
+    emptied before every run
+    """
+    vro = client(server.port)
+    workflow_id, execution_id = vro.run_workflow_named('test-workflow', INPUTS)
+
+    work_dir = tempfile.mkdtemp()
+    cache_dir = os.path.join(work_dir, 'cache')
+    latencies = []
+    try:
+        if warm:
+            run_generator(server, work_dir, cache_dir, workflow_id, execution_id)
+        requests = server.vro.requests
+        start = time.time()
+        for dummy in range(args.runs):
+            if not warm:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            run_start = time.time()
+            run_generator(server, work_dir, cache_dir, workflow_id, execution_id)
+            latencies.append(time.time() - run_start)
+        seconds = time.time() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return summarise(args.runs, seconds, latencies, server.vro.requests - requests)
+
+
+def bench_generator_cold(server, args):
+    """ the playbook generator compiling its templates on every run """
+    return bench_generator(server, args, warm=False)
+
+
+def compare(results, baseline, tolerance):
+    """ list the figures that regressed against the baseline """
+    regressions = []
+    for scenario, figures in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for key, worse in (('executions_per_second', lambda new, old: new < old * (1 - tolerance)),
+                           ('p50_latency', lambda new, old: new > old * (1 + tolerance)),
+                           ('p99_latency', lambda new, old: new > old * (1 + tolerance)),
+                           ('requests_per_execution', lambda new, old: new > old)):
+            if figures.get(key) is not None and base.get(key) is not None and \
+                    worse(figures[key], base[key]):
+                regressions.append("{} {}: {} (baseline {})".format(
+                    scenario, key, figures[key], base[key]))
+    return regressions
+
+
+def main():
+    """ main function """
+
+    if not HAS_MODULES:
+        print("The required modules could not be loaded")
+        sys.exit(1)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS))
+    parser.add_argument('--executions', type=int, default=100,
+                        help='executions launched by the client-batch scenario')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='executions run one by one by the other scenarios')
+    parser.add_argument('--timeout', type=int, default=600)
+    parser.add_argument('--output', type=str, help='save the results as JSON')
+    parser.add_argument('--baseline', type=str,
+                        help='fail on regressions against saved results')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    vro_mock_server.add_mock_arguments(parser)
+    parser.set_defaults(duration=0.5, history=20, seed=1)
+
+    args = parser.parse_args()
+
+    server = vro_mock_server.MockVROServer(vro_mock_server.mock_from_args(args)).start()
+
+    results = {}
+    try:
+        for scenario in args.scenarios.split(','):
+            if scenario not in SCENARIOS:
+                parser.error("unknown scenario: {}".format(scenario))
+            bench = globals()['bench_' + scenario.replace('-', '_')]
+            results[scenario] = bench(server, args)
+            print("{:<14} {}".format(scenario, json.dumps(results[scenario], sort_keys=True)))
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
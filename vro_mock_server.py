@@ -0,0 +1,358 @@
+#!/usr/bin/python
+"""
+Local stand-in for the vRealize Orchestrator REST API
+
+Serves the endpoints used by the vmware_vro_workflow.py Ansible module and
+vro_workflow_to_ansible.py over HTTPS with configurable latency, workflow run
+durations and failure rates, so that both can be exercised and benchmarked
+without a vRO appliance.  See vro_benchmark.py.
+"""
+
+from __future__ import print_function
+
+try:
+    import argparse
+    import datetime
+    import json
+    import os
+    import random
+    import shutil
+    import ssl
+    import subprocess
+    import sys
+    import tempfile
+    import threading
+    import time
+    import uuid
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+    HAS_MODULES = True
+except ImportError:
+    HAS_MODULES = False
+
+API_PREFIX = '/vco/api/'
+
+
+def iso_date(epoch):
+    """ format epoch seconds the way vRO returns dates """
+    return datetime.datetime.utcfromtimestamp(epoch).strftime(
+        '%Y-%m-%dT%H:%M:%S.') + '%03d+00:00' % (int(epoch * 1000) % 1000)
+
+
+def attributes(values):
+    """ vRO listing attribute list from a dictionary """
+    return [{'name': name, 'value': value} for name, value in values.items()]
+
+
+class MockVRO(object):
+    """ In memory workflows and executions of the mock appliance """
+
+    INPUTS = [{'name': 'attrSleep', 'type': 'number'},
+              {'name': 'inValue', 'type': 'string'},
+              {'name': 'inUserPass', 'type': 'SecureString'}]
+
+    def __init__(self, workflows=10, history=100, latency=0.0,
+                 duration=1.0, duration_jitter=0.0, failure_rate=0.0,
+                 reject_rate=0.0, seed=None):
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.duration = duration
+        self.duration_jitter = duration_jitter
+        self.failure_rate = failure_rate
+        self.reject_rate = reject_rate
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+
+        self.workflows = {'test-workflow': 'a7a1d06a-9018-40c4-9199-1ce95932311c'}
+        for index in range(1, workflows):
+            self.workflows['test-workflow-{}'.format(index)] = str(
+                uuid.UUID(int=self.random.getrandbits(128)))
+        self.names = sorted(self.workflows)
+
+        self.executions = {}
+        self.runs = dict((x, []) for x in self.workflows.values())
+        now = time.time()
+        for workflow_id in self.runs:
+            for index in range(history, 0, -1):
+                self._add_run(workflow_id, now - index * 60, {}, now=now)
+
+    def _add_run(self, workflow_id, start, inputs, now=None):
+        duration = max(0.0, self.random.uniform(self.duration - self.duration_jitter,
+                                                self.duration + self.duration_jitter))
+        execution_id = uuid.UUID(int=self.random.getrandbits(128)).hex
+        execution = {'id': execution_id,
+                     'workflow_id': workflow_id,
+                     'start': start,
+                     'end': start + duration,
+                     'final_state': 'failed' if self.random.random() < self.failure_rate
+                                    else 'completed',
+                     'inputs': inputs.get('parameters', [])}
+        self.executions[execution_id] = execution
+        self.runs[workflow_id].insert(0, execution)
+        return execution
+
+    @staticmethod
+    def state(execution):
+        if time.time() < execution['end']:
+            return 'running'
+        return execution['final_state']
+
+    def detail(self, execution):
+        state = self.state(execution)
+        href = "https://localhost{}workflows/{}/executions/{}/".format(
+            API_PREFIX, execution['workflow_id'], execution['id'])
+        detail = {'id': execution['id'],
+                  'href': href,
+                  'state': state,
+                  'start-date': iso_date(execution['start']),
+                  'started-by': 'vcoadmin',
+                  'input-parameters': execution['inputs'],
+                  'output-parameters': [],
+                  'relations': {'link': [{'href': href + 'state/', 'rel': 'down'},
+                                         {'href': href + 'logs/', 'rel': 'logs'}]}}
+        if state != 'running':
+            detail['end-date'] = iso_date(execution['end'])
+        if state == 'completed':
+            detail['output-parameters'] = [
+                {'name': 'outValue', 'type': 'string', 'scope': 'local',
+                 'value': {'string': {'value': 'Completed {}'.format(execution['id'])}}}]
+        return detail
+
+    def logs(self, execution, query):
+        """ log entries written so far, newest first, ten steps per run """
+        now = time.time()
+        step = (execution['end'] - execution['start']) / 10.0
+        entries = [(execution['start'], 'info', 'Workflow started')]
+        entries.extend((execution['start'] + x * step, 'info', 'Step {} of 9'.format(x))
+                       for x in range(1, 10))
+        entries.append((execution['end'], 'error' if execution['final_state'] == 'failed'
+                        else 'info', 'Workflow {}'.format(execution['final_state'])))
+        logs = [{'entry': {'time-stamp': iso_date(stamp), 'severity': severity,
+                           'origin': 'server', 'user': 'vcoadmin',
+                           'short-description': text, 'long-description': text}}
+                for stamp, severity, text in reversed(entries) if stamp <= now]
+        return 200, {'logs': self.page(logs, query)}
+
+    def summary(self, execution):
+        values = {'id': execution['id'],
+                  'state': self.state(execution),
+                  'startDate': iso_date(execution['start'])}
+        if values['state'] != 'running':
+            values['endDate'] = iso_date(execution['end'])
+        return {'attributes': attributes(values)}
+
+    @staticmethod
+    def page(items, query, default=100):
+        start = int(query.get('startIndex', ['0'])[0])
+        count = int(query.get('maxResult', [str(default)])[0])
+        return items[start:start + count]
+
+    def list_workflows(self, query):
+        names = self.names
+        for condition in query.get('conditions', []):
+            key, value = condition.split('=', 1)
+            if key == 'name':
+                names = [x for x in names if x == value]
+        links = [{'attributes': attributes({'id': self.workflows[x], 'name': x,
+                                            'categoryName': 'Benchmark'})}
+                 for x in self.page(names, query, len(names))]
+        return 200, {'total': len(names), 'link': links}
+
+    def list_executions(self, workflow_id, query):
+        runs = self.runs[workflow_id]
+        for condition in query.get('conditions', []):
+            key, value = condition.split('=', 1)
+            if key == 'state':
+                runs = [x for x in runs if self.state(x) == value]
+        links = [self.summary(x) for x in self.page(runs, query)]
+        return 200, {'relations': {'total': len(runs), 'link': links}}
+
+    def handle(self, method, path, body):
+        """ return status code, JSON body and headers of an API request """
+        with self.lock:
+            self.requests += 1
+            if self.reject_rate and self.random.random() < self.reject_rate:
+                self.rejected += 1
+                return 503, {}, {}
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        parts = url.path[len(API_PREFIX):].strip('/').split('/')
+
+        with self.lock:
+            if parts == ['about'] and method == 'GET':
+                return 200, {'version': '7.2.0', 'build-number': '4629841'}, {}
+
+            if parts == ['workflows'] and method == 'GET':
+                return self.list_workflows(query) + ({},)
+
+            if len(parts) < 2 or parts[0] != 'workflows' or parts[1] not in self.runs:
+                return 404, {}, {}
+            workflow_id = parts[1]
+
+            if len(parts) == 2 and method == 'GET':
+                return 200, {'id': workflow_id, 'input-parameters': self.INPUTS}, {}
+
+            if len(parts) == 3 and parts[2] == 'executions':
+                if method == 'POST':
+                    execution = self._add_run(workflow_id, time.time(),
+                                              json.loads(body or '{}'))
+                    location = "https://localhost{}workflows/{}/executions/{}/".format(
+                        API_PREFIX, workflow_id, execution['id'])
+                    return 202, None, {'Location': location}
+                return self.list_executions(workflow_id, query) + ({},)
+
+            execution = self.executions.get(parts[3]) if len(parts) > 3 else None
+            if execution is None or execution['workflow_id'] != workflow_id:
+                return 404, {}, {}
+
+            if len(parts) == 4:
+                return 200, self.detail(execution), {}
+
+            if len(parts) == 5 and parts[4] == 'state':
+                return 200, {'value': self.state(execution)}, {}
+
+            if len(parts) == 5 and parts[4] == 'logs':
+                return self.logs(execution, query) + ({},)
+
+        return 404, {}, {}
+
+
+class MockVROHandler(BaseHTTPRequestHandler):
+    """ HTTP/1.1 keep-alive request handler """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _respond(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            status, data, headers = 401, {}, {}
+        else:
+            status, data, headers = self.server.vro.handle(method, self.path, body)
+
+        raw_data = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw_data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw_data)
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+
+class MockVROServer(ThreadingHTTPServer):
+    """ HTTPS server for a MockVRO, optionally run in a background thread """
+
+    daemon_threads = True
+
+    def __init__(self, vro, port=0, certfile=None, keyfile=None, verbose=False):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), MockVROHandler)
+        self.vro = vro
+        self.verbose = verbose
+        self.cert_dir = None
+        if not certfile:
+            self.cert_dir = tempfile.mkdtemp()
+            certfile, keyfile = make_certificate(self.cert_dir)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.cert_dir:
+            shutil.rmtree(self.cert_dir, ignore_errors=True)
+
+
+def make_certificate(directory):
+    """ create a self-signed localhost certificate with the openssl CLI """
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                           '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                           '-keyout', keyfile, '-out', certfile],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def add_mock_arguments(parser):
+    """ mock appliance arguments shared with vro_benchmark.py """
+    parser.add_argument('--workflows', type=int, default=10)
+    parser.add_argument('--history', type=int, default=100,
+                        help='past runs of each workflow')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('--duration', type=float, default=1.0,
+                        help='mean seconds a workflow run takes')
+    parser.add_argument('--duration-jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--reject-rate', type=float, default=0.0,
+                        help='fraction of requests answered 503, as by an overloaded appliance')
+    parser.add_argument('--seed', type=int)
+
+
+def mock_from_args(args):
+    """ MockVRO from parsed add_mock_arguments() arguments """
+    return MockVRO(workflows=args.workflows, history=args.history,
+                   latency=args.latency, duration=args.duration,
+                   duration_jitter=args.duration_jitter,
+                   failure_rate=args.failure_rate,
+                   reject_rate=args.reject_rate, seed=args.seed)
+
+
+def main():
+    """ main function """
+
+    if not HAS_MODULES:
+        print("The required modules could not be loaded")
+        sys.exit(1)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--listeningport', type=int, default=8281)
+    parser.add_argument('--certfile', type=str)
+    parser.add_argument('--keyfile', type=str)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    add_mock_arguments(parser)
+
+    args = parser.parse_args()
+
+    server = MockVROServer(mock_from_args(args), args.listeningport,
+                           args.certfile, args.keyfile, args.verbose)
+    print("Mock vRO listening on https://127.0.0.1:{}{}".format(server.port, API_PREFIX))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
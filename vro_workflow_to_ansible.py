@@ -4,42 +4,77 @@
 Generate Ansible playbook and vars file from vRealize Orchestrator workflow
 
 Allows a vRO workflow to be executed from Ansible using vmware_vro_workflow.py
-Ansible module.
+Ansible module.  Many executions can be captured at once, from a list of
+workflow and execution ID pairs or the last executions of a workflow, into
+one vars file per execution or a combined one and a playbook that runs them
+as one batch task of the module.
+
+yaml, jinja2 and urllib3 are only imported once needed, and compiled
+templates are kept in a bytecode cache between runs, so that the script
+starts quickly when run in a loop.
 """
 
 from __future__ import print_function
 
 try:
     import json
-    import yaml
     import os
     import sys
-    from jinja2 import Environment, FileSystemLoader
     import argparse
     import getpass
-    import urllib3
-    from urllib3.exceptions import HTTPError, SSLError
     HAS_MODULES = True
 except ImportError:
     HAS_MODULES = False
 
 PATH = os.path.dirname(os.path.abspath(__file__))
-TEMPLATE_ENVIRONMENT = Environment(
-    autoescape=False,
-    loader=FileSystemLoader(os.path.join(PATH, 'templates')),
-    trim_blocks=False,
-    variable_start_string='"[%',
-    variable_end_string='%]"'
-    )
+TEMPLATE_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                              os.path.join(os.path.expanduser('~'), '.cache'),
+                              'vro_workflow_to_ansible')
+TEMPLATE_ENVIRONMENT = None
+
+
+def template_environment(template_dirs=None, cache_dir=TEMPLATE_CACHE):
+    """ Jinja2 environment, created on first use """
+    global TEMPLATE_ENVIRONMENT
+
+    if TEMPLATE_ENVIRONMENT is None:
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+        bytecode_cache = None
+        if cache_dir:
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                bytecode_cache = FileSystemBytecodeCache(cache_dir)
+            except (IOError, OSError):
+                pass
+
+        # user template directories are searched before the bundled ones
+        TEMPLATE_ENVIRONMENT = Environment(
+            autoescape=False,
+            loader=FileSystemLoader(list(template_dirs or []) +
+                                    [os.path.join(PATH, 'templates')]),
+            bytecode_cache=bytecode_cache,
+            trim_blocks=False,
+            variable_start_string='"[%',
+            variable_end_string='%]"'
+            )
+
+    return TEMPLATE_ENVIRONMENT
 
 
 class VROClient(object):
     """ VROClient Class """
 
     BASE_URL = "https://{}:{}/vco/api/workflows/{}/executions/{}/"
+    LIST_URL = "https://{}:{}/vco/api/workflows/{}/executions/" \
+               "?maxResult={}&startIndex=0&sortOrder=-startDate"
 
     def __init__(self, server, listeningport, username, password,
-                 workflowid, executionid, insecure):
+                 workflowid=None, executionid=None, insecure=True,
+                 maxsize=8):
+        import urllib3
+
         self.user = username
         self.pwd = password
         self.server = server
@@ -47,73 +82,194 @@ class VROClient(object):
         self.workflowid = workflowid
         self.executionid = executionid
         self.validate_certs = insecure
+        self.headers = urllib3.util.make_headers(basic_auth=self.user +
+                                                 ':' + self.pwd)
+        # one pool for every request, sized for the concurrent fetches
+        if not self.validate_certs:
+            urllib3.disable_warnings()
+            self.http = urllib3.PoolManager(maxsize=maxsize, cert_reqs='CERT_NONE')
+        else:
+            self.http = urllib3.PoolManager(maxsize=maxsize)
 
-    def _api_url(self):
+    def _api_url(self, workflowid=None, executionid=None):
         execution_path = self.BASE_URL.format(self.server, self.port,
-                                              self.workflowid,
-                                              self.executionid)
+                                              workflowid or self.workflowid,
+                                              executionid or self.executionid)
         return execution_path
 
-    def print_url(self):
+    def print_url(self, workflowid=None, executionid=None):
         """ output REST API URL """
-        print(self._api_url())
+        print(self._api_url(workflowid, executionid))
 
     def _do_get(self, path):
         """ perform REST API GET method """
 
-        if not self.validate_certs:
-            urllib3.disable_warnings()
-
-        http = urllib3.PoolManager()
-        headers = urllib3.util.make_headers(basic_auth=self.user +
-                                            ':' + self.pwd)
-
-        try:
-            resp = http.request('GET', path, headers=headers)
-        except (HTTPError, SSLError):
-            raise
+        resp = self.http.request('GET', path, headers=self.headers)
 
         return resp.status, resp.data
 
-    def get_workflow_execution(self):
+    def get_workflow_execution(self, workflowid=None, executionid=None):
         """ return data from vRO workflow execution """
 
-        path = self._api_url()
+        path = self._api_url(workflowid, executionid)
 
         status_code, data = self._do_get(path)
 
         if status_code != 200:
             fail_msg = "Failed to get state workflow: {} " \
-                       "execution id: {}".format(self.workflowid,
-                                                 self.executionid)
+                       "execution id: {}".format(workflowid or self.workflowid,
+                                                 executionid or self.executionid)
             raise ValueError(fail_msg)
 
         return data
 
+    def get_workflow_executions(self, executions, concurrency=8):
+        """ return data of many workflow executions, fetched concurrently """
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(max(1, min(concurrency, len(executions))))
+        try:
+            return pool.map(lambda x: self.get_workflow_execution(*x), executions)
+        finally:
+            pool.close()
+
+    def list_workflow_executions(self, count, state=None):
+        """ return the IDs of the last executions of the workflow """
+
+        path = self.LIST_URL.format(self.server, self.port, self.workflowid, count)
+        if state:
+            path += "&conditions=state={}".format(state)
+
+        status_code, data = self._do_get(path)
+
+        if status_code != 200:
+            raise ValueError("Failed to list executions of workflow: "
+                             "{}".format(self.workflowid))
+
+        executions = []
+        for link in json.loads(data).get('relations', {}).get('link', []):
+            attrs = dict((x['name'], x.get('value'))
+                         for x in link.get('attributes', []))
+            if attrs.get('id'):
+                executions.append(attrs['id'])
+
+        return executions[:count]
+
+
+def read_executions(source):
+    """ read workflow and execution ID pairs, one per line, from a file or - """
+
+    if source == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(source) as executions_file:
+            lines = executions_file.readlines()
+
+    executions = []
+    for line in lines:
+        line = line.split('#', 1)[0].replace(',', ' ').split()
+        if not line:
+            continue
+        if len(line) != 2:
+            raise ValueError("Expected a workflow ID and an execution ID: "
+                             "{}".format(' '.join(line)))
+        executions.append(tuple(line))
+
+    return executions
+
 
 def render_template(template_filename, context):
     """ render Jinja2 template """
-    return TEMPLATE_ENVIRONMENT.get_template(
+    return template_environment().get_template(
         template_filename).render(args_dict=context)
 
 
-def create_ansible_playbook(context):
+def create_ansible_playbook(context, fname="vro-playbook.yml",
+                            template_filename='playbook.j2'):
     """ create playbook file """
-    fname = "vro-playbook.yml"
 
     with open(fname, 'w') as yaml_file:
-        yaml_render = render_template('playbook.j2', context)
+        yaml_render = render_template(template_filename, context)
         yaml_file.write(yaml_render)
 
 
-def create_ansible_vars_file(vars_data):
+def create_ansible_vars_file(vars_data, fname="vro-vars.yml"):
     """ create vars file """
-    fname = "vro-vars.yml"
+    import yaml
 
     with open(fname, 'wt') as yaml_file:
         yaml.safe_dump(vars_data, yaml_file, default_flow_style=False)
 
 
+def execution_vars(workflowid, data):
+    """ batch item of the module re-running one execution """
+    return {'uuid': workflowid,
+            'inputs': {'parameters': json.loads(data)['input-parameters']}}
+
+
+def create_batch_files(args_dict, executions, results):
+    """ create the vars files and looping playbook of a batch """
+
+    output_dir = args_dict['outputdir']
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    batch_vars = [execution_vars(workflowid, data)
+                  for (workflowid, executionid), data in zip(executions, results)]
+
+    if args_dict['combined']:
+        create_ansible_vars_file({'workflow_batch': batch_vars},
+                                 os.path.join(output_dir, 'vro-vars.yml'))
+        args_dict['vars_files'] = ['vro-vars.yml']
+    else:
+        args_dict['vars_files'] = []
+        for (workflowid, executionid), item in zip(executions, batch_vars):
+            fname = 'vro-vars-{}.yml'.format(executionid)
+            create_ansible_vars_file(item, os.path.join(output_dir, fname))
+            args_dict['vars_files'].append(fname)
+
+    create_ansible_playbook(args_dict,
+                            os.path.join(output_dir, 'vro-batch-playbook.yml'),
+                            'batch-playbook.j2')
+
+
+def generate(args, args_dict, batch):
+    """ fetch the executions and write the playbook and vars files """
+
+    template_environment(args.templatedirs, args.templatecache)
+
+    vro = VROClient(args.server, args.listeningport, args.username,
+                    args_dict['password'], args.workflowid, args.executionid,
+                    args.insecure, maxsize=args.concurrency)
+
+    if not batch:
+        vro.print_url()
+
+        data = vro.get_workflow_execution()
+
+        json_data = json.loads(data)
+        input_params = json_data['input-parameters']
+        workflow_parameters = {"workflow_parameters": {"parameters": input_params}}
+
+        create_ansible_vars_file(workflow_parameters)
+
+        create_ansible_playbook(args_dict)
+        return
+
+    if args.executionsfile:
+        executions = read_executions(args.executionsfile)
+    else:
+        executions = [(args.workflowid, x)
+                      for x in vro.list_workflow_executions(args.last, args.state)]
+
+    results = vro.get_workflow_executions(executions, args.concurrency)
+
+    create_batch_files(args_dict, executions, results)
+
+    print("Captured {} executions in {}".format(
+        len(executions), os.path.join(args.outputdir, 'vro-batch-playbook.yml')))
+
+
 def main():
     """ main function """
 
@@ -125,32 +281,58 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--server', type=str, required=True)
     parser.add_argument('-l', '--listeningport', type=str, default='8281')
-    parser.add_argument('-e', '--executionid', type=str, required=True)
-    parser.add_argument('-w', '--workflowid', type=str, required=True)
+    parser.add_argument('-e', '--executionid', type=str)
+    parser.add_argument('-w', '--workflowid', type=str)
     parser.add_argument('-u', '--username', type=str, required=True)
     parser.add_argument('-p', '--password', type=str)
     parser.add_argument('-i', '--insecure', action='store_false')
+    parser.add_argument('-f', '--executions-file', type=str, dest='executionsfile',
+                        help='file of workflow and execution ID pairs, one per '
+                             'line, or - for stdin')
+    parser.add_argument('-n', '--last', type=int,
+                        help='capture the last N executions of --workflowid')
+    parser.add_argument('--state', type=str,
+                        help='with --last, only executions in this state')
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('--combined', action='store_true',
+                        help='write one vars file for the whole batch')
+    parser.add_argument('-o', '--output-dir', type=str, dest='outputdir',
+                        default='.')
+    parser.add_argument('-t', '--template-dir', type=str, dest='templatedirs',
+                        action='append', default=[],
+                        help='directory searched for playbook.j2 and '
+                             'batch-playbook.j2 before the bundled templates; '
+                             'may be repeated')
+    parser.add_argument('--template-cache', type=str, dest='templatecache',
+                        default=TEMPLATE_CACHE,
+                        help='directory of compiled templates kept between runs')
+    parser.add_argument('--no-template-cache', action='store_const',
+                        dest='templatecache', const=None)
 
     args = parser.parse_args()
     args_dict = vars(args)
 
+    batch = args.executionsfile or args.last
+    if args.executionsfile and args.last:
+        parser.error("--executions-file and --last are mutually exclusive")
+    if args.last and not args.workflowid:
+        parser.error("--last requires --workflowid")
+    if not batch and not (args.workflowid and args.executionid):
+        parser.error("--workflowid and --executionid are required, "
+                     "unless --executions-file or --last is given")
+
     if not args.password:
         args_dict['password'] = getpass.getpass(prompt='Enter vRO password: ')
 
-    vro = VROClient(**args_dict)
-
-    vro.print_url()
-
-    data = vro.get_workflow_execution()
-
-    json_data = json.loads(data)
-    input_params = json_data['input-parameters']
-    workflow_parameters = {"workflow_parameters": {"parameters": input_params}}
-
-    create_ansible_vars_file(workflow_parameters)
-
-    create_ansible_playbook(args_dict)
+    try:
+        generate(args, args_dict, batch)
+    except ImportError as err:
+        print("The required modules could not be loaded: {}".format(err))
+        sys.exit(1)
+    except (IOError, OSError, ValueError) as err:
+        print(err)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()